@@ -59,9 +59,9 @@ stns = stn_db.keys()
 for stn in stns:
   print(stn)
 
-  # Load train data.
-  X = pickle.load(open(train_dir + stn + '/scaled/X_train.pkl','rb'))
-  Y = pickle.load(open(train_dir + stn + '/scaled/Y_train.pkl','rb'))
+  # Load train data (memory-mapped).
+  X = np.load(train_dir + stn + '/scaled/X_train.npy', mmap_mode='r')
+  Y = np.load(train_dir + stn + '/scaled/Y_train.npy', mmap_mode='r')
   dimX = X.shape[-1]
   dimY = Y.shape[-1]
   
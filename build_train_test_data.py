@@ -17,7 +17,10 @@ If you increase the order of the Bernstein polynomial basis, the time taken to
 generate Vs profiles that satisfy the monotonicity constraint will significantly
 increase. This is because polynomials of increasing order are more "wiggly" and
 likely to feature negative Vs gradients. In my experience it's best not to use
-Bernstein polynomials of order > 4.
+Bernstein polynomials of order > 4 with the default rejection sampler. Setting
+sampler = 'sorted' below constructs monotonic profiles directly (from sorted
+Bernstein coefficients), which makes higher orders practical, at the cost of a
+different (narrower) distribution of profiles.
 
 Alternatively, you can try and remove the monotonicity constraint, but it will
 be much more work to successfully train a MDN for compliance inversion. 
@@ -29,16 +32,13 @@ Stephen Mosher, Mar. 2022
 
 # The usual suspects.
 import pickle
-import numpy as np
 
 # Import helper functions.
+from forward_funcs import gravd
 from utils import fetch, ML
 
 ##################################### SETUP ####################################
 
-# For consistency while prototyping/testing. Comment out if you like.
-np.random.seed(0)
-
 # Input/output directories. Output directories created if don't exist.
 stn_db = pickle.load(open('./data/stn_db.pkl', 'rb'))
 output_dir = './data/ML/'
@@ -51,19 +51,43 @@ order = 3                        # Bernstein polynomial order
 Nf = 6                           # Number of inversion frequencies
 low = 0.1                        # Minimum Vs value.
 high = 3.0                       # Maximum Vs value.
+sampler = 'rejection'            # Monotonic profile sampler ('rejection' or
+                                 # 'sorted').
 plot = True                      # Show plots of models? Useful to test. Will
                                  # only show 3 models.
+compress_tol = None              # Max relative η error allowed when merging
+                                 # 1m layers before forward computing η (e.g.
+                                 # 0.005). None disables layer merging.
+seed = 0                         # Random seed. Results are reproducible and
+                                 # don't depend on the number of workers.
+workers = 1                      # Number of worker processes.
+chunk_size = 1000                # Number of models per random stream/shard.
+gravd_cache = './data/gravd/'    # On-disk cache of IG wavenumbers (None to
+                                 # disable).
+
+# Wavenumbers depend only on station depth and frequencies, so reuse them.
+gravd.set_cache_dir(gravd_cache)
 
 ##################################### MAIN #####################################
 
-# Loop over stations and corresponding data contained in stn_db.
-for stn, data in stn_db.items():
+# Guard needed so worker processes can import this script safely.
+if __name__ == '__main__':
+
+  # Loop over stations and corresponding data contained in stn_db.
+  for i, (stn, data) in enumerate(stn_db.items()):
 
-  # Construct randomly generated training models for current station/depth.
-  ML.model_constructor(data, zmax, Nm_train, Nf, low, high, order, plot, output_dir+stn+'/train_')
+    # Construct randomly generated training models for current station/depth.
+    # Each station and train/test set gets its own seed derived from seed.
+    ML.model_constructor(data, zmax, Nm_train, Nf, low, high, order, plot,
+                         output_dir+stn+'/train_', compress_tol,
+                         seed=[seed, i, 0], workers=workers,
+                         chunk_size=chunk_size, sampler=sampler)
   
-  # Construct randomly generated testing models for current station/depth.
-  ML.model_constructor(data, zmax, Nm_test, Nf, low, high, order, plot, output_dir+stn+'/test_')
+    # Construct randomly generated testing models for current station/depth.
+    ML.model_constructor(data, zmax, Nm_test, Nf, low, high, order, plot,
+                         output_dir+stn+'/test_', compress_tol,
+                         seed=[seed, i, 1], workers=workers,
+                         chunk_size=chunk_size, sampler=sampler)
 
 
   
@@ -0,0 +1,114 @@
+'''
+FUNCTION SET compress.py
+
+Functions to compress layered Earth models before forward computing η.
+
+Training models are discretized at 1m, i.e. thousands of layers, but smooth
+Vs(z) profiles barely change between adjacent layers. The cost of the
+propagator scales with the number of layers, so merging layers whose Vs
+differs by less than a relative tolerance gives a much cheaper model with
+almost the same η. Merged layers are Backus averaged: thickness weighted mean
+density, and thickness weighted harmonic mean of the shear and P-wave moduli.
+The bottom layer acts as the half-space and is never merged.
+
+compress() searches for the coarsest merging tolerance that keeps η within a
+given relative error of the uncompressed models at the inversion frequencies,
+and reports the error it introduced. That error is only known for the models
+compress() was given. compression_error() checks a tolerance on other models,
+e.g. a sample of those it's then applied to.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# The usual.
+import numpy as np
+
+# Forward modelling code.
+from forward_funcs import ncomp_fortran
+
+################################## FUNCTIONS ###################################
+
+def merge_layers(model, rtol):
+  '''
+  Merge adjacent layers of a (n_layers, 4) model [thickness, ρ, Vp, Vs] into
+  layers over which Vs changes by less than a factor of (1 + rtol). Layers are
+  grouped by binning log(Vs), so this works in a single vectorized pass.
+  '''
+
+  # Bin every layer but the half-space by log(Vs) relative to the top layer.
+  # A new merged layer starts wherever the bin changes.
+  Vs = model[:-1, 3]
+  bins = np.floor(np.log(Vs / Vs[0]) / np.log1p(rtol))
+  starts = np.concatenate([[0], np.flatnonzero(np.diff(bins)) + 1,
+                           [len(model) - 1]])
+
+  # Backus average the properties within each merged layer.
+  d = model[:, 0]
+  thickness = np.add.reduceat(d, starts)
+  ρ = np.add.reduceat(d * model[:, 1], starts) / thickness
+  μ = thickness / np.add.reduceat(d / (model[:, 1] * model[:, 3]**2), starts)
+  M = thickness / np.add.reduceat(d / (model[:, 1] * model[:, 2]**2), starts)
+
+  return np.column_stack([thickness, ρ, np.sqrt(M / ρ), np.sqrt(μ / ρ)])
+
+def compress_models(models, rtol):
+  '''
+  Merge the layers of every model in a (N, n_layers, 4) stack. Compressed
+  models end up with different numbers of layers, so they're padded at the top
+  with zero-thickness copies of their top layer (which leave η unchanged) to
+  give a (N, max_layers, 4) stack that can be passed to ncomp_fortran_batch().
+  '''
+
+  merged = [merge_layers(model, rtol) for model in models]
+  n_layers = max(len(model) for model in merged)
+
+  compressed = np.zeros(shape=(len(merged), n_layers, 4))
+  for i, model in enumerate(merged):
+    n_pad = n_layers - len(model)
+    compressed[i, n_pad:] = model
+    compressed[i, :n_pad, 1:] = model[0, 1:]
+
+  return compressed
+
+def compress(depth, freqs, models, tol=0.005, rtol=0.2, min_rtol=1e-4):
+  '''
+  Find the coarsest compression of a model (or a stack of models) for which
+  the maximum relative error in η at freqs stays within tol. Starting from
+  rtol, the merging tolerance is halved until the error is acceptable. If no
+  tolerance above min_rtol works, the models are returned uncompressed.
+
+  Returns the compressed models, the merging tolerance used (None if the
+  models were left uncompressed), and the maximum relative error in η that
+  the compression introduced.
+  '''
+
+  # Treat a single model as a stack of one.
+  models = np.asarray(models, dtype=float)
+  if models.ndim == 2:
+    models = models[np.newaxis]
+
+  # Reference η for the full models.
+  η = ncomp_fortran.ncomp_fortran_batch(depth, freqs, models)
+
+  while rtol >= min_rtol:
+    compressed = compress_models(models, rtol)
+    η_compressed = ncomp_fortran.ncomp_fortran_batch(depth, freqs, compressed)
+    error = np.amax(np.abs(η_compressed - η) / np.abs(η))
+    if error <= tol:
+      return compressed, rtol, error
+    rtol = rtol / 2
+
+  return models, None, 0.0
+
+
+def compression_error(depth, freqs, models, rtol):
+  '''
+  The maximum relative error in η at freqs that merging layers with the
+  tolerance rtol introduces, over a (N, n_layers, 4) stack of models.
+  '''
+  η = ncomp_fortran.ncomp_fortran_batch(depth, freqs, models)
+  compressed = compress_models(models, rtol)
+  η_compressed = ncomp_fortran.ncomp_fortran_batch(depth, freqs, compressed)
+  return np.amax(np.abs(η_compressed - η) / np.abs(η))
\ No newline at end of file
@@ -6,6 +6,10 @@ compliance from synthetic Earth structure
 
 Original source can be found at (http://www.ipgp.fr/~crawford/Homepage/Software.html).
 
+ncomp_fortran_batch() computes η for a whole stack of models in one call to the
+compiled code, which avoids one Python-to-Fortran round trip per model and per
+frequency when building training data.
+
 Stephen Mosher, Feb 2020. 
 '''
 
@@ -18,17 +22,44 @@ import numpy as np
 # file and it has to be compiled using F2PY from NumPy.
 from forward_funcs import gravd, raydep_ft
 
-################################### FUNCTION ###################################
+################################## FUNCTIONS ###################################
 
-def ncomp_fortran(depth, freqs, model):
+def ncomp_fortran(depth, freqs, model, surface_only=True):
   # Compute wavenumber of infragravity waves and slowness vectors.
   ω = 2 * np.pi * freqs
-  k = gravd.gravd(ω, depth)
+  k = gravd.wavenumbers(ω, depth)
   p = k / ω
 
-  # Compute normalized compliance.
+  # Compute normalized compliance. Only the seafloor displacement and stress
+  # are needed, so by default skip reconstructing the full-depth eigenfunctions.
   ncomp = np.zeros(len(ω))
   for i in range(len(p)):
-    v, u, sigzz, sigzx = raydep_ft.raydep_ft(p[i], ω[i], model)
-    ncomp[i] = -k[i] * v[0] / (ω[i] * sigzz[0])
-  return ncomp
\ No newline at end of file
+    if surface_only:
+      v0, sigzz0 = raydep_ft.raydep_surface_ft(p[i], ω[i], model)
+    else:
+      v, u, sigzz, sigzx = raydep_ft.raydep_ft(p[i], ω[i], model)
+      v0, sigzz0 = v[0], sigzz[0]
+    ncomp[i] = -k[i] * v0 / (ω[i] * sigzz0)
+  return ncomp
+
+def ncomp_fortran_batch(depth, freqs, models):
+  '''
+  Compute normalized compliance for a stack of models of shape
+  (N, n_layers, 4), i.e. models with the same number of layers, at the
+  frequencies freqs.
+  A single (n_layers, 4) model is treated as a stack of one.
+
+  Returns an (N, Nf) array of η.
+  '''
+
+  # Compute wavenumber of infragravity waves once for all models.
+  ω = 2 * np.pi * freqs
+  k = gravd.wavenumbers(ω, depth)
+
+  # Promote a single model to a stack of one.
+  models = np.asarray(models, dtype=float)
+  if models.ndim == 2:
+    models = models[np.newaxis]
+
+  # Loops over models and frequencies happen inside the compiled code.
+  return raydep_ft.ncomp_batch_ft(k, ω, models)
\ No newline at end of file
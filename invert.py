@@ -15,16 +15,12 @@ Stephen Mosher, Mar. 2022
 
 #################################### IMPORTS ###################################
 
-# Handy module for working with MDNs - available @ https://github.com/cpmpercussion/keras-mdn-layer
-import mdn
-
 # The usual.
 import pickle
 import numpy as np
-import tensorflow as tf
 
 # Helper functions.
-from utils import fetch, misc, ML, plot, setup, structural
+from utils import inversion, misc, ML, plot, setup, structural
 
 ##################################### SETUP ####################################
 
@@ -41,94 +37,81 @@ stns = ['A02W']
 # training the MDNs (in principle, could be a list of different Ks).
 K = 6
 
-# The number times to sample from the GMM output by the MDNs.
+# The number times to sample from the GMM output by the MDNs. Sampling is
+# vectorized, so this can be large.
 N_samples = 1000
 
+# How to compute the 95% levels of the sampled profiles (see
+# misc.percentile_levels()). 'binned' gives the same levels as 'kde', faster.
+levels_method = 'binned'
+
+# Compute the mean profile and 95% levels exactly from the GMM, rather than by
+# sampling it (in which case no sampled profiles are plotted).
+analytic = False
+
+# Seed for sampling the GMMs (None for different samples each run).
+seed = None
+rng = np.random.default_rng(seed)
+
 # Loop over stations and the MDNs trained for each station/situation.
 for stn in stns:
 
-  # Station-dependant directories.
-  model_dir = './data/ML/' + stn + '/train_models/'
-  scaling_dir = './data/ML/' + stn + '/scaled/'
-  
-  # Load a training example (first one) to grab a bunch of useful parameters
-  model_fle = fetch.data_paths(model_dir)[0]
-  sample_model = pickle.load(open(model_fle, 'rb'))
-  
-  # Extract training model parameters.
-  zmax = sample_model['max_z_m']
-  dimX = sample_model['dimX']
-  dimY = sample_model['dimY']
-  inv_freqs = sample_model['inv_freqs']
+  ################################ LOAD NETWORK ################################
 
-  # Order of Bernstein polynomials.
-  order = dimY - 1
+  # Load the MDN, the scaling of its training signals, and the training set
+  # metadata to grab a bunch of useful parameters (see utils/inversion.py to
+  # invert many signals at once).
+  inverter = inversion.load(stn, K, network_dir, './data/ML/')
+  zmax = inverter['zmax']
+  order = inverter['order']
 
   # Load measured/synthetic compliance signal to be inverted.
   measured_data = pickle.load(open(signal_dir + stn + '.pkl', 'rb'))
 
-  # Slice measured/synthetic η at the inversion frequencies.
-  freqs = measured_data['freqs']
-  inv_freq_idxs = [misc.idx_of_closest(target, freqs) for target in inv_freqs]
-  η = measured_data['μ_η'][inv_freq_idxs]
-
-  # Scale measured signal (it must be treated the same way the training signals
-  # were treated).
-  μ_scaling = pickle.load(open(scaling_dir + 'μ_train.pkl', 'rb'))
-  σ_scaling = pickle.load(open(scaling_dir +'σ_train.pkl', 'rb'))
+  # The input into the trained MDN is the measured compliance signal, sliced at
+  # the inversion frequencies, scaled and treated in the same manner as were the
+  # training signals.
+  X = inversion.inputs(inverter, measured_data['freqs'], measured_data['μ_η'])
 
-  # The input into the trained MDN is the measured compliance signal, scaled and
-  # treated in the same manner as were the training signals.
-  X = ML.scale_real_input(η, μ_scaling, σ_scaling)
-
-  # Initialize arrays to hold Bernstein basis coefficients obtained from each
-  # sample of the GMM and the corresponding Vs profiles.  
-  coeffs = np.zeros(shape=(N_samples, dimY))
-  profiles = np.zeros(shape=(N_samples, zmax))
-  
-  ################################ LOAD NETWORK ################################
-  
-  MDN = tf.keras.models.load_model(network_dir + stn + '.h5',  
-                          custom_objects={'MDN': mdn.MDN,
-                          'mdn_loss_func': mdn.get_mixture_loss_func(dimY, K)})
-  
   ########################### PREDICT GMM PARAMETERS ###########################
   
-  # The Guassian mixture model predicted by the MDN, based on input X.
-  GMM = MDN.predict(X.reshape(1, dimX))
-  
-  ''' 
-  Helpful to know how to get individual GMM components if desired...
-
-  # Extract the GMM parameters (means μ, standard deviations σ, mixture
-  # coefficients π.
-  μ = np.apply_along_axis((lambda a: a[:K*dimY]), 1, GMM)
-  σ = np.apply_along_axis((lambda a: a[K*dimY:2*K*dimY]), 1, GMM)
-  π = np.apply_along_axis((lambda a: mdn.softmax(a[2*K*dimY:])), 1, GMM)
-
-  '''
+  # The Guassian mixture model predicted by the MDN, based on input X, split
+  # into its parameters (means μ, standard deviations σ, mixture coefficients
+  # π).
+  μ, σ, π = [param[0] for param in inversion.predict(inverter, X)]
   
   ################################## ANALYSIS ##################################
   
-  # Sample the GMM output by the MDN and record the Bernstein basis coefficients
-  # of each sample.
-  for i in range(N_samples):
-    print('Sampling from GMM learned by the MDN: ' + str(i + 1))
-    coeffs[i] = mdn.sample_from_output(GMM[0], dimY, K)
+  if analytic:
+
+    # Vs(z) is linear in the coefficients, so at each depth the posterior is
+    # itself a Gaussian mixture. Its mean and 95% levels are computed exactly,
+    # no sampling needed. L - 2.5% bounds, U - 97.5% bounds
+    m, s = ML.mixture_profiles(μ, σ, zmax, order)
+    μ_profile = ML.mixture_mean(m, π)
+    L, U = ML.mixture_quantiles(m, s, π, [0.025, 0.975])
+    profiles = None
+
+  else:
+
+    # Sample the GMM output by the MDN and record the Bernstein basis
+    # coefficients of each sample.
+    print('Sampling from GMM learned by the MDN...')
+    coeffs = ML.sample_mixture(μ, σ, π, N_samples, rng)
   
-  # Compute the mean of the sampled coefficients.
-  μ_coeffs = np.mean(coeffs, axis=0)
+    # Compute the mean of the sampled coefficients.
+    μ_coeffs = np.mean(coeffs, axis=0)
 
-  # Construct the Vs profile that corresponds to the mean coeffs.
-  z = np.linspace(0, zmax/1000, zmax)
-  μ_profile = structural.bernstein_profile(z/(zmax/1000), order, μ_coeffs)
+    # Construct the Vs profile that corresponds to the mean coeffs.
+    μ_profile = structural.bernstein_profiles_cached(zmax, order, μ_coeffs)
   
-  # Νοw generate ALL profile estimates from ALL coefficient samples.
-  profiles = [structural.bernstein_profile(z/(zmax/1000), order, c) for c in coeffs]
-  profiles = np.array(profiles)
+    # Νοw generate ALL profile estimates from ALL coefficient samples, in one
+    # matmul with the Bernstein basis.
+    profiles = structural.bernstein_profiles_cached(zmax, order, coeffs)
 
-  # Compute 95% levels of the sampled profiles. L - 2.5% bounds, U - 97.5% bounds
-  L, U = misc.percentile_levels(profiles) 
+    # Compute 95% levels of the sampled profiles. L - 2.5% bounds, U - 97.5%
+    # bounds
+    L, U = misc.percentile_levels(profiles, levels_method)
 
   ############################### ASSESSMENT PLOT ##############################
 
@@ -1,13 +1,19 @@
 '''
 SCRIPT prep_MDN_data.py
 
-This script loads individual training and testing examples created for training
-and evaluating a MDN, respectively. It then creates np.arrays to hold all the 
-examples, performs feature scaling on those examples, then saves them to disk.
+This script loads the sets of training and testing examples created for
+training and evaluating a MDN, respectively. Each set is stored as contiguous
+arrays on disk (see ./utils/store.py), so it's loaded in one go, memory-mapped
+rather than read example by example. The script then performs feature scaling
+on those examples and saves them to disk as .npy arrays.
 
 This way inputs to the network can be preloaded and prepared to be passed
 directly to a MDN. 
 
+In streaming mode, scaling parameters are accumulated in a single pass over
+blocks of examples and the scaled examples are written block by block, so
+memory use stays bounded however many examples there are.
+
 Stephen Mosher, Mar. 2022
 '''
 
@@ -18,7 +24,13 @@ import pickle
 import numpy as np
 
 # Helper function.
-from utils import fetch, ML, setup
+from utils import ML, setup, store
+
+##################################### SETUP ####################################
+
+# Stream examples through in blocks rather than loading whole sets into memory?
+streaming = True
+chunk = 100000                   # Number of examples per block when streaming.
 
 ##################################### MAIN #####################################
 
@@ -36,52 +48,29 @@ for stn in stns:
   output_dir = './data/ML/'+stn+'/scaled/'
   setup.directory(output_dir)
   
-  # Build lists of paths to training examples.
-  train_m_fles = fetch.data_paths(input_dir + 'train_models/')
-  train_η_fles = fetch.data_paths(input_dir + 'train_signals/')
-  
-  # Build lists of paths to testing examples.
-  test_m_fles = fetch.data_paths(input_dir + 'test_models/')
-  test_η_fles = fetch.data_paths(input_dir + 'test_signals/')
-  
-  # Count number of training and testing examples.
-  N_train = len(train_η_fles)
-  N_test = len(test_η_fles)
-  
-  # Load a sample training example to get dimensional information.
-  sample_η = pickle.load(open(train_η_fles[0], 'rb'))
-  sample_m = pickle.load(open(train_m_fles[0], 'rb'))
-  dimX = len(sample_η)
-  dimY = len(sample_m['B'])
-  
-  # Initialize np arrays to hold all train/test examples.
-  X_train = np.zeros(shape=(N_train, dimX)) # Observed η(ω) at inv freqs.
-  Y_train = np.zeros(shape=(N_train, dimY)) # Bernstein coeffs for Vs(z).
-  X_test = np.zeros(shape=(N_test, dimX))   #             .              
-  Y_test = np.zeros(shape=(N_test, dimY))   #             .
-  
-  # Loop through training examples and populate X and Y, then perform scaling.
-  for i, (η, m) in enumerate(zip(train_η_fles, train_m_fles)):
-    print('Loading/prepping training example: ' + str(i))
-    signl = pickle.load(open(η, 'rb'))
-    model = pickle.load(open(m, 'rb'))
-    X_train[i] = signl
-    Y_train[i] = model['B']
-  X_train = ML.feature_scaling(X_train, 'train', output_dir)
-  
-  # Loop through test examples and populate X and Y, then perform scaling.
-  for i, (η, m) in enumerate(zip(test_η_fles, test_m_fles)):
-    print('Loading/prepping test example: ' + str(i))
-    signl = pickle.load(open(η, 'rb'))
-    model = pickle.load(open(m, 'rb'))
-    X_test[i] = signl
-    Y_test[i] = model['B']
-  X_test = ML.feature_scaling(X_test, 'test', output_dir)
-  
-  # Scaling parameters get written to disk for later use.
-  
-  # Write X,Y to disk
-  pickle.dump(X_train, open(output_dir+'X_train.pkl', 'wb'))
-  pickle.dump(X_test, open(output_dir+'X_test.pkl', 'wb'))
-  pickle.dump(Y_train, open(output_dir+'Y_train.pkl', 'wb'))
-  pickle.dump(Y_test, open(output_dir+'Y_test.pkl', 'wb'))
\ No newline at end of file
+  # Memory-map the training and testing examples.
+  # X: observed η(ω) at inv freqs. Y: Bernstein coeffs for Vs(z).
+  X_train, Y_train, meta = store.load(input_dir + 'train_')
+  X_test, Y_test, meta = store.load(input_dir + 'test_')
+  print('Loading/prepping ' + str(len(X_train)) + ' training and ' +
+        str(len(X_test)) + ' testing examples: ' + stn)
+
+  # Perform scaling and write X,Y to disk, block by block.
+  if streaming:
+
+    # Scaling parameters get written to disk for later use.
+    ML.feature_scaling_streamed(X_train, 'train', output_dir, chunk)
+    ML.feature_scaling_streamed(X_test, 'test', output_dir, chunk)
+    store.copy(Y_train, output_dir+'Y_train.npy', chunk)
+    store.copy(Y_test, output_dir+'Y_test.npy', chunk)
+
+  # Or all in memory.
+  else:
+
+    # Scaling parameters get written to disk for later use.
+    X_train = ML.feature_scaling(X_train, 'train', output_dir)
+    X_test = ML.feature_scaling(X_test, 'test', output_dir)
+    np.save(output_dir+'X_train.npy', X_train)
+    np.save(output_dir+'X_test.npy', X_test)
+    np.save(output_dir+'Y_train.npy', Y_train)
+    np.save(output_dir+'Y_test.npy', Y_test)
\ No newline at end of file
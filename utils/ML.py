@@ -12,17 +12,23 @@ Stephen Mosher, Mar. 2022
 # The usual.
 import time
 import pickle
+import multiprocessing
 import numpy as np
 
+# Normal CDF, for quantiles of Gaussian mixtures.
+from scipy.special import ndtr
+
 # Forward modelling code
-from forward_funcs import ncomp_fortran
+from forward_funcs import compress, ncomp_fortran
 
 # Helper functions.
-from utils import misc, ML, plot, setup, structural
+from utils import misc, ML, plot, store, structural
 
 ################################### FUNCTIONS ##################################
 
-def model_constructor(data, zmax, Nm, Nf, low, high, order, test_plot, outdir):
+def model_constructor(data, zmax, Nm, Nf, low, high, order, test_plot, outdir,
+                      compress_tol=None, N_calib=100, seed=0, workers=1,
+                      chunk_size=1000, sampler='rejection', N_check=100):
   '''
   This function constructs "examples" for machine learning applications.
 
@@ -32,11 +38,30 @@ def model_constructor(data, zmax, Nm, Nf, low, high, order, test_plot, outdir):
   The function that performs the forward computation was translated, by myself,
   from MATLAB code origianlly written by Wayne Crawford. His original code can
   be found at http://www.ipgp.fr/~crawford/Homepage/Software.html
-  '''
 
-  # Setup output directories for both the structural models and the signals.
-  setup.directory(outdir+'models/')
-  setup.directory(outdir+'signals/')
+  The Nm examples are split into chunks of chunk_size, each with its own random
+  stream spawned from numpy.random.SeedSequence(seed). Chunks are built by a
+  pool of worker processes, each writing the examples of the chunks it builds.
+  Because the chunks and their streams don't depend on the number of workers,
+  the output is bit-identical however many workers are used.
+
+  Examples are written to a single set of contiguous arrays prefixed by outdir
+  (see ./utils/store.py): η signals to outdir + 'X.npy', Bernstein coefficients
+  to outdir + 'Y.npy', and the parameters shared by all examples to
+  outdir + 'meta.pkl'. Each chunk fills its own block of rows.
+
+  Monotonic Vs profiles are drawn in batches with structural.sample_monotonic(),
+  using the given sampler ('rejection' or 'sorted', see ./utils/structural.py).
+
+  If compress_tol is given, the 1m layers of each model are merged before
+  forward computing η (see ./forward_funcs/compress.py). The merging tolerance
+  is calibrated on N_calib models drawn from a separate stream, such that the
+  maximum relative error in η stays within compress_tol, and then used for all
+  chunks. The error reported for the calibration models is only an estimate
+  for the rest, so once all examples are built, the compressed η of N_check of
+  them (drawn from another separate stream) is checked against the
+  uncompressed η, and a warning is printed if the error exceeds compress_tol.
+  '''
 
   # Extract parameters for current depth-context.
   stn = data['stn']
@@ -62,102 +87,185 @@ def model_constructor(data, zmax, Nm, Nf, low, high, order, test_plot, outdir):
   γ = γ[idxs_of_query_freqs]
   σ = σ[idxs_of_query_freqs]
 
-  # Array of model depths in [km], discretized at 1m intervals.
-  z = np.linspace(0, zmax/1000, zmax)
-
   # Initialize a timer.
   t1 = time.time()
 
-  # Initialize a model counter.
-  j = 0
+  # Independent random streams: the first for calibrating layer merging, the
+  # last for checking it, the rest for the chunks of examples.
+  chunk_starts = range(0, Nm, chunk_size)
+  streams = np.random.SeedSequence(seed).spawn(len(chunk_starts) + 2)
+
+  # Calibrate the layer merging tolerance once, for all chunks.
+  rtol = None
+  if compress_tol is not None:
+    rng = np.random.default_rng(streams[0])
+    z = np.linspace(0, 1, zmax)
+    coeffs = structural.sample_monotonic(rng, N_calib, z, order, low, high,
+                                         sampler)
+    profiles = structural.bernstein_profiles_cached(zmax, order, coeffs)
+    structures = _layered_models(profiles)
+    structures, rtol, compress_err = compress.compress(h, inv_freqs, structures,
+                                                       tol=compress_tol)
+    print('Layer merging tolerance:', rtol, '- max relative η error over',
+          N_calib, 'calibration models:', compress_err,
+          '(an estimate for the full set, checked once built)')
+
+  # Create the (empty) set of examples on disk, along with its metadata.
+  meta = {'stn': stn,
+          'max_z_km': zmax/1000,
+          'max_z_m': zmax,
+          'inv_freqs': inv_freqs,
+          'h': h,
+          'dimX': len(inv_freqs),
+          'dimY': order + 1,
+          'order': order,
+          'sampler': sampler,
+          'rtol': rtol}
+  store.create(outdir, Nm, meta)
+
+  # Everything a worker needs to build a chunk of examples.
+  params = {'stn': stn,
+            'γ': γ,
+            'σ': σ,
+            'h': h,
+            'inv_freqs': inv_freqs,
+            'zmax': zmax,
+            'order': order,
+            'low': low,
+            'high': high,
+            'sampler': sampler,
+            'rtol': rtol,
+            'outdir': outdir}
+  chunks = [(params, start, min(chunk_size, Nm - start), stream)
+            for start, stream in zip(chunk_starts, streams[1:-1])]
+
+  # Build the chunks, in this process or spread over a pool of workers.
+  model_type = outdir.split('/')[-1].split('_')[0]+'ing'
+  if workers > 1:
+    with multiprocessing.Pool(workers) as pool:
+      for j in pool.imap_unordered(_build_chunk, chunks):
+        print('generated ' + str(j) + ' ' + model_type + ' models, ' + stn)
+  else:
+    for chunk in chunks:
+      j = _build_chunk(chunk)
+      print('generated ' + str(j) + ' ' + model_type + ' models, ' + stn)
+
+  # Spot-check the merging tolerance on a random sample of the built models.
+  if rtol is not None:
+    rng = np.random.default_rng(streams[-1])
+    X, Y, meta = store.load(outdir)
+    check = np.sort(rng.choice(Nm, size=min(N_check, Nm), replace=False))
+    profiles = structural.bernstein_profiles_cached(zmax, order, Y[check])
+    check_err = compress.compression_error(h, inv_freqs,
+                                           _layered_models(profiles), rtol)
+    print('Max relative η error from layer merging over', len(check),
+          'generated models:', check_err)
+    if check_err > compress_tol:
+      print('WARNING: layer merging error exceeds compress_tol =',
+            compress_tol, '- consider a smaller compress_tol or more',
+            'calibration models (N_calib).')
 
-  # Loop until Nm models have been successfully created.
-  while j < Nm:
+  # Let's see how long it takes to make the models.  
+  t2 = time.time()
+  print('Total Time: ' + str(t2 - t1), 'seconds for', Nm, 'models')
 
-    print('generating a random model...')
-    # Generate random Bernstein coefficients on the interval [low, high]
-    coeff = np.random.uniform(low=low, high=high, size=order+1)
+  # Plot a few models?
+  if test_plot == True:
+    X, Y, meta = store.load(outdir)
+    for Vs in structural.bernstein_profiles_cached(zmax, order, Y[:3]):
+      plot.model(zmax, np.ones(len(Vs)) * 6.0, Vs, np.ones(len(Vs)) * 2.0)
 
-    # Construct random Vs profile from the Bernstein coefficients.
-    Vs = structural.bernstein_profile(z/(zmax/1000), order, coeff)
+def _layered_models(Vs):
+  '''
+  Turn a (N, zmax) array of Vs profiles into a (N, zmax, 4) stack of layered
+  models [thickness, ρ, Vp, Vs] to be passed to the forward code.
+  '''
 
-    # Enforce monotonicity constraint.
-    print('enforcing monotonicity...')
-    if (np.diff(Vs) < 0).any():
-      print('monotonicity condition violated...')
-      continue
+  # Compute Vp and ρ from Vs (kept simple here, more options in 
+  # ./utils/structural.py)
+  Vp = np.ones(Vs.shape) * 6.0
+  ρ = np.ones(Vs.shape) * 2.0       # Following Zha and Webb, 2016.
 
-    # Compute Vp and ρ from Vs (kept simple here, more options in 
-    # ./utils/structural.py)
-    Vp = np.ones(len(Vs)) * 6.0
-    ρ = np.ones(len(Vs)) * 2.0       # Following Zha and Webb, 2016.
-    
-    # Plot a model?
-    if test_plot == True:
-      if j < 3:
-        plot.model(zmax, Vp, Vs, ρ)
-  
-    # Forward compute normalized compliance of model using my translation of
-    # Wayne Crawford's code (location of source indicated in title block).
-    
-    # Layer thicknesses in meters (we're effectively assuming 1m thicknesses)
-    thicknesses = np.ones(zmax)
-    thicknesses = thicknesses.reshape(len(thicknesses), 1)
+  # Layer thicknesses in meters (we're effectively assuming 1m thicknesses)
+  thicknesses = np.ones(Vs.shape)
+
+  return np.stack([thicknesses, ρ, Vp, Vs], axis=2)
+
+def _build_chunk(chunk):
+  '''
+  Build one chunk of examples from its own random stream and write them to
+  their block of rows, starting at the start index of the chunk. Returns the
+  number built.
+
+  Models are drawn, forward computed and checked in batches: all coefficient
+  sets still needed are drawn at once, η is computed for all of them in a
+  single call to the compiled code, and any that fail the sanity checks are
+  replaced in the next pass.
+  '''
 
-    ρ = ρ.reshape(thicknesses.shape)
-    Vp = Vp.reshape(thicknesses.shape)
-    Vs = Vs.reshape(thicknesses.shape)
+  params, start, Nm, stream = chunk
+  rng = np.random.default_rng(stream)
 
-    structure = np.hstack([thicknesses, ρ, Vp, Vs])
+  # Unpack parameters shared by all chunks.
+  γ = params['γ']
+  σ = params['σ']
+  h = params['h']
+  inv_freqs = params['inv_freqs']
+  zmax = params['zmax']
+  order = params['order']
+  rtol = params['rtol']
+  outdir = params['outdir']
 
-    # Call to fortran code to compute η. It's faster than MATLAB but needs to 
-    # be compiled on your machine.
-    η = ncomp_fortran.ncomp_fortran(depth=h, freqs=inv_freqs, model=structure)
+  # Normalized depths of the 1m layers.
+  z = np.linspace(0, 1, zmax)
+
+  # Arrays to hold the chunk's signals and coefficients.
+  X = np.zeros(shape=(Nm, len(inv_freqs)))
+  Y = np.zeros(shape=(Nm, order + 1))
+
+  # Initialize a model counter.
+  j = 0
+
+  # Loop until Nm models have been successfully created.
+  while j < Nm:
+
+    # Random Bernstein coefficients that give monotonic Vs profiles, the
+    # profiles themselves, and the corresponding layered models.
+    coeffs = structural.sample_monotonic(rng, Nm - j, z, order, params['low'],
+                                         params['high'], params['sampler'])
+    profiles = structural.bernstein_profiles_cached(zmax, order, coeffs)
+    structures = _layered_models(profiles)
+
+    # Merge layers with the calibrated tolerance, if compressing.
+    if rtol is not None:
+      structures = compress.compress_models(structures, rtol)
+
+    # Forward compute normalized compliance of the models using my translation
+    # of Wayne Crawford's code (location of source indicated in title block).
+    # It's faster than MATLAB but needs to be compiled on your machine.
+    ηs = ncomp_fortran.ncomp_fortran_batch(h, inv_freqs, structures)
     
     # Noise.
-    ε = np.random.uniform(low=σ[:,0], high=σ[:,1])
+    ε = rng.uniform(low=σ[:,0], high=σ[:,1], size=ηs.shape)
     
-    # Weight forward computed signal by γ and apply noise.
-    η = γ * η * ε
+    # Weight forward computed signals by γ and apply noise.
+    ηs = γ * ηs * ε
   
     # Some sanity checks.
-    if (η < 0).any():
-      continue
-    if (η == 0).any():
-      continue
-    if np.isnan(η).any():
-      continue
-
-    # If model survives monotonicity constraint and sanity, print out statement.
-    model_type = outdir.split('/')[-1].split('_')[0]+'ing'
-    print('generated '+ model_type +' model: ' + str(j) + ', ' + stn)
-  
-    # Write model components into a dictionary.
-    model = {'Vs': Vs,
-             'B': coeff,
-             'max_z_km': zmax/1000,
-             'max_z_m': zmax,
-             'inv_freqs': inv_freqs,
-             'h': h,
-             'dimX': len(inv_freqs),
-             'dimY': len(coeff)}
-    
-    # Use model counter as an id.
-    number = str(j)
+    sane = ~((ηs <= 0) | np.isnan(ηs)).any(axis=1)
 
-    # Write both the model and signal to disk.
-    model_fpath = outdir + 'models/mod_' + number + '.pkl'
-    pickle.dump(model, open(model_fpath, 'wb'))
-  
-    # Save signal.
-    pickle.dump(η, open(outdir + 'signals/sig_' + number + '.pkl', 'wb'))
+    # Keep the examples that survived.
+    n = np.sum(sane)
+    X[j:j+n] = ηs[sane]
+    Y[j:j+n] = coeffs[sane]
   
     # Increase j
-    j += 1
-  
-  # Let's see how long it takes to make the models.  
-  t2 = time.time()
-  print('Total Time: ' + str(t2 - t1), 'seconds for', j, 'models')
+    j += n
+
+  # Write the chunk's block of rows to disk.
+  store.write(outdir, start, X, Y)
+
+  return j
 
 def feature_scaling(X, dset, outdir):
 
@@ -182,8 +290,142 @@ def feature_scaling(X, dset, outdir):
 
   return(X)
 
+def log_moments(X, chunk=100000):
+
+  '''
+  Mean and standard deviation of log10(X) along axis 0, computed in a single
+  pass over blocks of chunk rows. Each block's mean and sum of squared
+  deviations are merged into the running totals (Chan et al.'s parallel form
+  of Welford's algorithm), so X can be a memory-mapped array of any length.
+  '''
+
+  n = 0
+  μ = np.zeros(X.shape[1])
+  M2 = np.zeros(X.shape[1])
+
+  for start in range(0, len(X), chunk):
+    block = np.log10(X[start:start+chunk])
+    n_block = len(block)
+    μ_block = np.mean(block, axis=0)
+    M2_block = np.sum((block - μ_block)**2, axis=0)
+
+    # Merge the block into the running statistics.
+    δ = μ_block - μ
+    n_total = n + n_block
+    μ = μ + δ * n_block / n_total
+    M2 = M2 + M2_block + δ**2 * n * n_block / n_total
+    n = n_total
+
+  return μ, np.sqrt(M2 / n)
+
+def feature_scaling_streamed(X, dset, outdir, chunk=100000):
+
+  '''
+  Streaming counterpart to feature_scaling(). The scaling parameters come from
+  log_moments() and are written to disk the same way, then the scaled examples
+  are written to outdir + '/X_' + dset + '.npy' a block of chunk rows at a time,
+  so memory use doesn't depend on the number of examples.
+  '''
+
+  # Record and dump scaling parameters - need later.
+  μ, σ = log_moments(X, chunk)
+  pickle.dump(μ, open(outdir + '/μ_'+ dset +'.pkl', 'wb'))
+  pickle.dump(σ, open(outdir + '/σ_'+ dset +'.pkl', 'wb'))
+
+  print('writing scaling parameters to disk...')
+
+  # Scale, block by block.
+  return store.copy(X, outdir + '/X_' + dset + '.npy', chunk,
+                    lambda block: (np.log10(block) - μ)/σ)
+
 def scale_real_input(η, μ, σ):
   '''
   Feature-scaling for a real compliance signal to be passed to a trained MDN.
   '''
-  return (np.log10(η) - μ)/σ
\ No newline at end of file
+  return (np.log10(η) - μ)/σ
+
+def split_mixture(GMM, dimY, K, temp=1.0):
+  '''
+  Split the output of a MDN into the parameters of its K-component Gaussian
+  mixture over the dimY Bernstein coefficients. GMM is of shape (2*K*dimY+K,),
+  or (M, 2*K*dimY+K) for M predictions at once. Returns the means μ and
+  standard deviations σ, of shape (..., K, dimY), and the mixture weights π, of
+  shape (..., K), i.e. the softmax of the mixture logits (at temperature temp,
+  as in mdn.sample_from_output()).
+  '''
+  GMM = np.asarray(GMM, dtype=float)
+  μ = GMM[..., :K*dimY].reshape(GMM.shape[:-1] + (K, dimY))
+  σ = GMM[..., K*dimY:2*K*dimY].reshape(GMM.shape[:-1] + (K, dimY))
+
+  # Softmax, shifted by the max logit so the exponentials can't overflow.
+  logits = GMM[..., 2*K*dimY:] / temp
+  π = np.exp(logits - np.max(logits, axis=-1, keepdims=True))
+  π = π / np.sum(π, axis=-1, keepdims=True)
+
+  return μ, σ, π
+
+def sample_mixture(μ, σ, π, N, rng=None, sigma_temp=1.0):
+  '''
+  Draw N samples from a single Gaussian mixture (as returned by
+  split_mixture()) with diagonal covariances. All N component indices, and then
+  all N Gaussian draws, are made at once, which is equivalent to calling
+  mdn.sample_from_output() N times. Returns an (N, dimY) array of coefficients.
+  '''
+  rng = np.random.default_rng(rng)
+
+  # Pick a component for each sample, then draw from it.
+  k = rng.choice(len(π), size=N, p=π)
+  draws = rng.standard_normal((N, μ.shape[-1]))
+
+  return μ[k] + σ[k] * np.sqrt(sigma_temp) * draws
+
+def mixture_profiles(μ, σ, zmax, order):
+  '''
+  Vs(z) is linear in the Bernstein coefficients, so each Gaussian component of
+  a mixture over the coefficients (as returned by split_mixture(), with any
+  leading dimensions) maps to a Gaussian at each depth. Returns the means
+  B @ μ_k and standard deviations sqrt(B^2 @ σ_k^2) of those Gaussians at the
+  zmax depths, each of shape (..., K, zmax), where B is the cached Bernstein
+  basis matrix.
+  '''
+  B = structural.cached_bernstein_matrix(zmax, order)
+  return μ @ B.T, np.sqrt(σ**2 @ (B**2).T)
+
+def mixture_mean(m, π):
+  '''
+  Mean of a Gaussian mixture at each depth, given the per-depth component means
+  m (..., K, zmax) (see mixture_profiles()) and the mixture weights π (..., K).
+  '''
+  return np.sum(π[..., np.newaxis] * m, axis=-2)
+
+def mixture_quantiles(m, s, π, q, tol=1e-6, max_iter=100):
+  '''
+  q-quantile(s) of a Gaussian mixture at each depth, given the per-depth
+  component means m and standard deviations s (..., K, zmax) (see
+  mixture_profiles()) and the mixture weights π (..., K). All depths and
+  quantiles are found together, by bisection on the mixture CDF, to within tol
+  (in the units of m). Returns an array of shape (..., zmax), or
+  (len(q), ..., zmax) if q is an array.
+  '''
+  q = np.asarray(q, dtype=float)
+  levels = np.atleast_1d(q).reshape((-1,) + (1,) * (m.ndim - 1))
+  π = π[..., np.newaxis]
+
+  # The quantiles lie within the range of the components' own extreme tails.
+  shape = levels.shape[:1] + m.shape[:-2] + m.shape[-1:]
+  lo = np.broadcast_to(np.amin(m - 10*s, axis=-2), shape).copy()
+  hi = np.broadcast_to(np.amax(m + 10*s, axis=-2), shape).copy()
+  s = np.maximum(s, np.finfo(float).tiny)
+
+  # Halve the brackets until they're narrower than tol everywhere.
+  for i in range(max_iter):
+    mid = (lo + hi) / 2
+    cdf = np.sum(π * ndtr((mid[..., np.newaxis, :] - m) / s), axis=-2)
+    below = cdf < levels
+    lo = np.where(below, mid, lo)
+    hi = np.where(below, hi, mid)
+    if np.amax(hi - lo) < tol:
+      break
+
+  quantiles = (lo + hi) / 2
+  return quantiles[0] if q.ndim == 0 else quantiles
\ No newline at end of file
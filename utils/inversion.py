@@ -0,0 +1,115 @@
+'''
+FUNCTION SET inversion.py
+
+A set of functions to invert many compliance signals with a station's trained
+MDN at once, e.g. every daily η curve of a deployment for a time-lapse
+inversion, or bootstrap resamples of the station average.
+
+load() reads everything an inversion needs for a station a single time (the
+network, the feature scaling parameters and the training set metadata) into an
+"inverter" dictionary. invert() then scales all signals, makes a single batched
+call to predict(), and returns the posteriors as arrays: the GMM parameters of
+each signal, and the mean Vs profile and levels computed exactly from each GMM
+(see ML.mixture_profiles()), rather than by sampling.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# Handy module for working with MDNs - available @ https://github.com/cpmpercussion/keras-mdn-layer
+import mdn
+
+# The usual.
+import pickle
+import numpy as np
+import tensorflow as tf
+
+# Helper functions.
+from utils import misc, ML, store
+
+################################## FUNCTIONS ###################################
+
+def load(stn, K, network_dir='./MDN_models/', data_dir='./data/ML/'):
+  '''
+  Load the MDN trained for a station (with K mixture components), the scaling
+  parameters of its training signals, and its training set metadata. Returns
+  them as an inverter dictionary, to be passed to predict() and invert().
+  '''
+
+  # Training set metadata.
+  meta = store.meta(data_dir + stn + '/train_')
+  dimY = meta['dimY']
+
+  # Scaling parameters of the training signals.
+  scaling_dir = data_dir + stn + '/scaled/'
+  μ_scaling = pickle.load(open(scaling_dir + 'μ_train.pkl', 'rb'))
+  σ_scaling = pickle.load(open(scaling_dir + 'σ_train.pkl', 'rb'))
+
+  # The network.
+  MDN = tf.keras.models.load_model(network_dir + stn + '.h5',
+                          custom_objects={'MDN': mdn.MDN,
+                          'mdn_loss_func': mdn.get_mixture_loss_func(dimY, K)})
+
+  return {'stn': stn,
+          'MDN': MDN,
+          'K': K,
+          'zmax': meta['max_z_m'],
+          'dimX': meta['dimX'],
+          'dimY': dimY,
+          'order': dimY - 1,
+          'inv_freqs': meta['inv_freqs'],
+          'μ_scaling': μ_scaling,
+          'σ_scaling': σ_scaling}
+
+def inputs(inverter, freqs, ηs):
+  '''
+  Slice (N, F) η signals, measured at freqs, at the inversion frequencies and
+  scale them as the training signals were. Returns an (N, dimX) array.
+  '''
+  inv_freqs = inverter['inv_freqs']
+  idxs = [misc.idx_of_closest(target, freqs) for target in inv_freqs]
+  ηs = np.atleast_2d(ηs)[:, idxs]
+  μ, σ = inverter['μ_scaling'], inverter['σ_scaling']
+  return ML.scale_real_input(ηs, μ, σ)
+
+def predict(inverter, X, batch_size=4096):
+  '''
+  The GMMs predicted by the MDN for (N, dimX) scaled inputs X, in one batched
+  call. Returns μ and σ of shape (N, K, dimY), and π of shape (N, K) (see
+  ML.split_mixture()).
+  '''
+  GMM = inverter['MDN'].predict(X.reshape(-1, inverter['dimX']),
+                                batch_size=batch_size, verbose=0)
+  return ML.split_mixture(GMM, inverter['dimY'], inverter['K'])
+
+def invert(inverter, freqs, ηs, levels=(0.025, 0.975), batch_size=4096,
+           chunk=64):
+  '''
+  Invert (N, F) η signals measured at freqs. Returns a dictionary of arrays:
+
+    'μ', 'σ', 'π' - the GMM parameters of each signal (see predict())
+    'mean'        - (N, zmax) mean Vs profiles
+    'levels'      - (len(levels), N, zmax) Vs profiles at the given levels
+
+  The profiles are computed from the GMMs of chunk signals at a time, which
+  bounds memory use.
+  '''
+
+  # One batched prediction for all signals.
+  μ, σ, π = predict(inverter, inputs(inverter, freqs, ηs), batch_size)
+  N = len(μ)
+  zmax = inverter['zmax']
+  order = inverter['order']
+
+  # Exact posterior statistics of Vs(z), a chunk of signals at a time.
+  mean = np.zeros(shape=(N, zmax))
+  quantiles = np.zeros(shape=(len(levels), N, zmax))
+  for start in range(0, N, chunk):
+    stop = start + chunk
+    m, s = ML.mixture_profiles(μ[start:stop], σ[start:stop], zmax, order)
+    mean[start:stop] = ML.mixture_mean(m, π[start:stop])
+    quantiles[:, start:stop] = ML.mixture_quantiles(m, s, π[start:stop],
+                                                    levels)
+
+  return {'μ': μ, 'σ': σ, 'π': π, 'mean': mean, 'levels': quantiles}
\ No newline at end of file
@@ -23,18 +23,63 @@ def idx_of_closest(target_value, array):
   idx = np.argmin(np.abs(target_value - array))
   return idx
 
-def percentile_levels(data):
+def percentile_levels(data, method='kde', bins=1024, check=False, tol=0.01):
   '''
   Given a 2D numpy array of data, of shape (number_observations, length of
   signals), compute the 95% limits for the signals across their domain.
+
+  method is one of:
+
+    'kde'      - at each domain value, fit a Gaussian KDE to the observations,
+                 evaluate it at each (sorted) observation, and take the points
+                 where the cumulative sum of those densities reaches 2.5 and
+                 97.5%, as fractions of the way along the range of the
+                 observations. O(N^2) for N observations, at every domain value.
+    'binned'   - the same levels as 'kde', but with the KDE computed on a grid
+                 of bins points by linear binning and an FFT convolution, for
+                 all domain values at once. O(N log N).
+    'quantile' - the empirical 2.5 and 97.5% quantiles of the observations
+                 (np.quantile). These are not the same as the 'kde' levels,
+                 which are weighted by density and spread over the range.
+
+  If check is True, the 'kde' levels are also computed, and the largest
+  difference from them, as a fraction of the width of the 'kde' band, is
+  printed. A ValueError is raised if it's more than tol.
+  '''
+
+  print('Computing 95% levels...')
+
+  if method == 'kde':
+    L, U = _kde_levels(data)
+  elif method == 'binned':
+    L, U = _binned_kde_levels(data, bins)
+  elif method == 'quantile':
+    L, U = np.quantile(data, [0.025, 0.975], axis=0)
+  else:
+    raise ValueError("method must be 'kde', 'binned' or 'quantile'")
+
+  # Compare with the KDE levels, if asked.
+  if check and method != 'kde':
+    L_kde, U_kde = _kde_levels(data)
+    width = np.maximum(U_kde - L_kde, np.finfo(float).tiny)
+    diff = np.maximum(np.abs(L - L_kde), np.abs(U - U_kde)) / width
+    print('Max difference from KDE levels:', np.amax(diff), 'of band width')
+    if np.amax(diff) > tol:
+      raise ValueError("'" + method + "' levels differ from 'kde' levels by " +
+                       str(np.amax(diff)) + ' of the band width (tol ' +
+                       str(tol) + ')')
+
+  return (L,U)
+
+def _kde_levels(data):
+  '''
+  The 'kde' levels of percentile_levels().
   '''
 
   # Initialize arrays to hold the lower bounds L at 2.5% and the upper bounds U
   # at 97.5%
   L = np.zeros(data.shape[1])
   U = np.zeros(data.shape[1])
-  
-  print('Computing 95% levels...')
 
   # For each value in the domain of the individual signals...
   for i in range(data.shape[1]):
@@ -61,4 +106,55 @@ def percentile_levels(data):
     L[i] = distribution_axis[np.argmin(np.abs(cdf - 0.025))]
     U[i] = distribution_axis[np.argmin(np.abs(cdf - 0.975))]
 
+  return (L,U)
+
+def _binned_kde_levels(data, bins=1024, chunk=256):
+  '''
+  The 'binned' levels of percentile_levels(), for chunk domain values at a time.
+  '''
+  N = data.shape[0]
+  L = np.zeros(data.shape[1])
+  U = np.zeros(data.shape[1])
+
+  # Gaussian kernel offsets, in bins, for a linear (not circular) convolution.
+  offsets = np.arange(-(bins - 1), bins)
+  n_fft = 2 * bins
+
+  for start in range(0, data.shape[1], chunk):
+    samples = np.sort(data[:, start:start+chunk], axis=0)
+    D = samples.shape[1]
+    lo = samples[0]
+    hi = samples[-1]
+
+    # Grid spanning the samples, and Scott's rule bandwidth (as gaussian_kde).
+    Δ = np.maximum(hi - lo, np.finfo(float).tiny) / (bins - 1)
+    bw = np.std(samples, axis=0, ddof=1) * N**(-1/5)
+
+    # Linear binning, i.e. split each sample between its two nearest bins.
+    pos = (samples - lo) / Δ
+    idx = np.clip(np.floor(pos).astype(int), 0, bins - 2)
+    frac = pos - idx
+    flat = idx + bins * np.arange(D)
+    counts = (np.bincount(flat.ravel(), (1 - frac).ravel(), D * bins) +
+              np.bincount(flat.ravel() + 1, frac.ravel(), D * bins))
+    counts = counts.reshape(D, bins)
+
+    # Convolve the counts with the kernel. The kernel is wrapped so that offset
+    # 0 is at index 0, and the zero padding keeps the convolution linear.
+    bw = np.maximum(bw, np.finfo(float).tiny)
+    kernel = np.exp(-0.5 * (offsets * (Δ / bw)[:, np.newaxis])**2)
+    kernel = np.roll(np.pad(kernel, ((0, 0), (0, 1))), -(bins - 1), axis=1)
+    density = np.fft.irfft(np.fft.rfft(counts, n_fft) *
+                           np.fft.rfft(kernel, n_fft), n_fft)[:, :bins]
+
+    # Interpolate the density back to the (sorted) samples, and take the levels
+    # from the normalized cumulative sum, as for the 'kde' levels.
+    cols = np.arange(D)
+    pdf = density[cols, idx] * (1 - frac) + density[cols, idx + 1] * frac
+    cdf = np.cumsum(pdf, axis=0) / np.sum(pdf, axis=0)
+    i_L = np.argmin(np.abs(cdf - 0.025), axis=0)
+    i_U = np.argmin(np.abs(cdf - 0.975), axis=0)
+    L[start:start+chunk] = lo + (hi - lo) * i_L / (N - 1)
+    U[start:start+chunk] = lo + (hi - lo) * i_U / (N - 1)
+
   return (L,U)
\ No newline at end of file
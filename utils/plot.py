@@ -67,9 +67,11 @@ def inversion_result(profiles, μ_Vs, zmax, order, U, L, stn, output):
   # Depth axis.
   z = np.linspace(0, zmax/1000, zmax)
   
-  # Plot each sampled profile in orange, transparent. Place bottom layer.
-  for Vs in profiles:
-    ax.plot(Vs, z, color='orange', alpha=0.05, zorder=0)
+  # Plot each sampled profile in orange, transparent. Place bottom layer. There
+  # are none if the result was computed without sampling.
+  if profiles is not None:
+    for Vs in profiles:
+      ax.plot(Vs, z, color='orange', alpha=0.05, zorder=0)
   
   # Plot 95% levels of sampled profiles in black.
   ax.plot(U, z, 'k')
@@ -83,7 +85,10 @@ def inversion_result(profiles, μ_Vs, zmax, order, U, L, stn, output):
   ax.set_xlabel('$V_S$ [km/s]')
 
   # Axis limits.
-  ax.set_xlim(0, np.amax(profiles + 1.0))
+  if profiles is not None:
+    ax.set_xlim(0, np.amax(profiles + 1.0))
+  else:
+    ax.set_xlim(0, np.amax(U + 1.0))
   
   # Depth down.
   ax.xaxis.tick_top()  
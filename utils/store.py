@@ -0,0 +1,82 @@
+'''
+FUNCTION SET store.py
+
+A set of functions to store a set of training/testing examples as contiguous
+arrays on disk, rather than as one pair of pickles per example.
+
+A set is identified by a path prefix (e.g. ./data/ML/STN/train_) and consists
+of three files:
+
+  - prefix + 'X.npy'    - (Nm, dimX) array of η signals at the inversion freqs
+  - prefix + 'Y.npy'    - (Nm, dimY) array of Bernstein coefficients for Vs(z)
+  - prefix + 'meta.pkl' - one dictionary of parameters shared by all examples
+
+The arrays are standard .npy files, so they can be opened with np.load() using
+mmap_mode, and written a block of rows at a time without loading the rest.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# The usual.
+import os
+import pickle
+import numpy as np
+
+# Helper functions.
+from utils import setup
+
+################################## FUNCTIONS ###################################
+
+def create(prefix, Nm, meta):
+  '''
+  Create an empty set of Nm examples, with dimensions taken from meta['dimX']
+  and meta['dimY'], and write its metadata to disk.
+  '''
+  setup.directory(os.path.dirname(prefix) + '/')
+  np.lib.format.open_memmap(prefix + 'X.npy', mode='w+', dtype=float,
+                            shape=(Nm, meta['dimX']))
+  np.lib.format.open_memmap(prefix + 'Y.npy', mode='w+', dtype=float,
+                            shape=(Nm, meta['dimY']))
+  pickle.dump(dict(meta, Nm=Nm), open(prefix + 'meta.pkl', 'wb'))
+
+def write(prefix, start, X, Y):
+  '''
+  Write a block of examples into rows start:start+len(X) of an existing set.
+  Different processes can safely write different blocks of the same set.
+  '''
+  for key, block in zip(['X', 'Y'], [X, Y]):
+    data = np.load(prefix + key + '.npy', mmap_mode='r+')
+    data[start:start + len(block)] = block
+    data.flush()
+    del data
+
+def load(prefix, mmap_mode='r'):
+  '''
+  Load a set of examples. By default X and Y are memory-mapped rather than
+  read into memory. Returns X, Y and the metadata dictionary.
+  '''
+  X = np.load(prefix + 'X.npy', mmap_mode=mmap_mode)
+  Y = np.load(prefix + 'Y.npy', mmap_mode=mmap_mode)
+  return X, Y, meta(prefix)
+
+def meta(prefix):
+  '''
+  Load only the metadata of a set of examples.
+  '''
+  return pickle.load(open(prefix + 'meta.pkl', 'rb'))
+
+def copy(data, path, chunk=100000, transform=None):
+  '''
+  Copy a (possibly memory-mapped) array to a .npy file at path, a block of
+  chunk rows at a time, optionally applying transform to each block. Returns
+  the copy, memory-mapped.
+  '''
+  out = np.lib.format.open_memmap(path, mode='w+', dtype=float,
+                                  shape=data.shape)
+  for start in range(0, len(data), chunk):
+    block = data[start:start+chunk]
+    out[start:start+chunk] = block if transform is None else transform(block)
+  out.flush()
+  return out
@@ -10,6 +10,7 @@ Stephen Mosher, Mar. 2022
 #################################### IMPORTS ###################################
 
 # The usual.
+import functools
 import numpy as np
 
 # For constructing Bernstein basis.
@@ -53,4 +54,66 @@ def bernstein_profile(z, order, coeff):
   profile = np.zeros(len(z))
   for j in range(order+1):
     profile += coeff[j] * bernstein_basis(z, order, j)
-  return(profile)
\ No newline at end of file
+  return(profile)
+
+# Evaluate all order+1 Bernstein basis polynomials at depths z, as the columns of
+# a (len(z), order+1) matrix. Profiles are then a single matmul, coeffs @ B.T.
+def bernstein_matrix(z, order):
+  j = np.arange(order+1)
+  z = np.asarray(z, dtype=float)[:, np.newaxis]
+  return binom(order, j) * (1 - z)**(order - j) * z**j
+
+# The Bernstein basis matrix at the zmax normalized depths linspace(0, 1, zmax)
+# used throughout, built once per (zmax, order) and cached. Read-only, as it's
+# shared by every caller.
+@functools.lru_cache(maxsize=32)
+def cached_bernstein_matrix(zmax, order):
+  B = bernstein_matrix(np.linspace(0, 1, zmax), order)
+  B.flags.writeable = False
+  return B
+
+# Build Vs profiles from a (N, order+1) array of Bernstein coefficients at once.
+def bernstein_profiles(z, order, coeffs):
+  assert coeffs.shape[1] == order + 1
+  return coeffs @ bernstein_matrix(z, order).T
+
+# Build Vs profiles from a (N, order+1) array (or a single set) of Bernstein
+# coefficients at zmax normalized depths, with the cached basis matrix.
+def bernstein_profiles_cached(zmax, order, coeffs):
+  assert np.shape(coeffs)[-1] == order + 1
+  return coeffs @ cached_bernstein_matrix(zmax, order).T
+
+# Check which of a (N, order+1) array of Bernstein coefficients give Vs profiles
+# that are non-decreasing over z. The derivative of a Bernstein polynomial is a
+# Bernstein polynomial of one order less, with coefficients order*diff(coeff).
+# Non-negative derivative coefficients are sufficient for monotonicity, and a
+# negative first or last one (the derivative at z=0 or z=1) rules it out. Only
+# the remaining cases need the derivative evaluated over z.
+def is_monotonic(z, order, coeffs):
+  d = order * np.diff(coeffs, axis=1)
+  monotonic = (d >= 0).all(axis=1)
+  undecided = ~monotonic & (d[:, 0] >= 0) & (d[:, -1] >= 0)
+  if undecided.any():
+    slopes = bernstein_profiles(z, order - 1, d[undecided])
+    monotonic[undecided] = (slopes >= 0).all(axis=1)
+  return monotonic
+
+# Draw N sets of Bernstein coefficients on the interval [low, high] that give
+# non-decreasing Vs profiles over z.
+#
+#   'rejection' - draw batches of uniform coefficients and keep the monotonic
+#                 ones, i.e. the same distribution as drawing one at a time.
+#   'sorted'    - sort uniform coefficients so they're non-decreasing. Always
+#                 monotonic, so no draws are wasted and high orders are cheap,
+#                 but it only covers profiles with non-decreasing coefficients
+#                 and the distribution differs from 'rejection'.
+def sample_monotonic(rng, N, z, order, low, high, method='rejection', batch=4096):
+  if method not in ['rejection', 'sorted']:
+    raise ValueError("method must be 'rejection' or 'sorted'")
+  if method == 'sorted':
+    return np.sort(rng.uniform(low=low, high=high, size=(N, order+1)), axis=1)
+  coeffs = np.zeros(shape=(0, order+1))
+  while len(coeffs) < N:
+    candidates = rng.uniform(low=low, high=high, size=(batch, order+1))
+    coeffs = np.vstack([coeffs, candidates[is_monotonic(z, order, candidates)]])
+  return coeffs[:N]
\ No newline at end of file
@@ -9,8 +9,10 @@ stations (pressure, vertical, and horizontals) for each day that the station
 has data. 
 
 Daily spectral quantities, namely, auto- and cross-spectral densities b/w 
-each of the components are written into a Python dictionary and written to an
-output directory as .pkl files. Spectral densities are computed as follows:
+each of the components are appended to a per-station archive (one directory per
+station, see utils/archive.py), or optionally written into a Python dictionary
+and written to an output directory as .pkl files. Spectral densities are
+computed as follows:
 
  - A given day of OBS data (full 24-hours) is split into several (possibly 
    overlapping) windows.
@@ -31,7 +33,19 @@ Janiszewski, available at (https://github.com/helenjanisz/ATaCR). OBStools and
 ATaCR are sophisticated suites of tools for processing and working with data
 recorded by OBSs. 
 
-The portions of code not written by me are clearly indicated below.
+The portions of code not written by me are in utils/daily.py, and are clearly
+indicated there.
+
+Each station-day is independent, so station-days are processed in parallel by
+a pool of worker processes (set workers below). If something goes wrong with a
+day of data, that day is reported and skipped, and the rest carry on. When
+writing archives, days already in a station's archive are skipped, so the
+script can be re-run as new data comes in.
+
+Files are found through a (station, day, channel) index built from the file
+names (see utils/ingest.py), which is cached between runs. When processing
+days serially, the traces of upcoming days are read on a pool of threads while
+the current day is being processed.
 
 Stephen Mosher, Mar. 2022
 '''
@@ -39,14 +53,11 @@ Stephen Mosher, Mar. 2022
 #################################### IMPORTS ###################################
 
 # The usual suspects.
-import pickle
-import numpy as np
-from obspy import read
-from scipy.linalg import norm
-from scipy.signal import spectrogram
+import time
+import multiprocessing
 
 # Several helper functions.
-from utils import fetch, fourier, ftest, setup, smooth
+from utils import archive, daily, ingest, setup
 
 ##################################### SETUP ####################################
 
@@ -55,180 +66,92 @@ input_dir = '../data/raw_data/YL/'
 output_dir = '../data/spectral/daily_spectral_quantities/'
 setup.directory(output_dir)
 
+# Cache of the index of the .SAC files, kept out of output_dir so it isn't
+# mistaken for a day of results.
+cache_dir = '../data/cache/'
+setup.directory(cache_dir)
+
 # Parameters for computing spectral densities.
 wlen_sec = 3600      # len of individual windows within a day [s]
 olap_percent = 0.5   # window overlap [as a decimal fraction between 0 and 1]
 minwin = 10          # minimum number of good windows required for a result.
 
-##################################### MAIN #####################################
+# Output format.
+use_archive = True   # one archive per station, otherwise one .pkl per day
 
-# Place all paths to files to be processed in a Python list.
-fle_paths = fetch.data_paths(input_dir)
-
-# Determine the stations that have data to be processed from the list of files.
-stns = np.unique([path.split('/')[4].split('.')[6] for path in fle_paths])
-
-# Loop over stations.
-for stn in stns:
-
-  # Filter files to only those that belong to the current station.
-  stn_fles = [fle for fle in fle_paths if stn in fle]
-
-  # Determine the days (time-keys) during which the station has data.
-  stn_tks = np.unique([fle.split('/')[-1].split('YL')[0].split(':')[0] + ':00' for fle in stn_fles])
-  
-  # Loop and process data during days/time-keys that the station has data.
-  for tk in stn_tks:
-    
-    # Handy print statement.
-    print(stn, tk)
-
-    # Filter the the stn_fles to only those files during the current day.
-    current_day_fles = [fle for fle in stn_fles if tk in fle]
-
-    # The order of the station's channels is critical! Ensure the following 
-    # order: P, 1, 2, Z.
-    current_day_fles.sort(key=lambda x: x.split('.')[10])
-
-    # The above sorting doesn't always work. Need to address at some point. It's
-    # also path dependent. Make more general in the future.
-
-    # Read each station component as an ObsPy Trace Object, then group in list.
-    trP = read(current_day_fles[0])[0]
-    tr1 = read(current_day_fles[1])[0]
-    tr2 = read(current_day_fles[2])[0]
-    trZ = read(current_day_fles[3])[0]
-    traces = [trP, tr1, tr2, trZ]
-
-    # Length check. Sometimes traces have 1 point more or less than full day.
-    # I can't remember why this is, it has something to do with DSP... Causes
-    # trouble if not careful. 
-    for tr in traces:
-
-      # Check for 1 data point too many. If so, remove last point.
-      if len(tr.data) - 86400 == 1:
-        tr.data = tr.data[0:-1]
-
-      # Check for 1 data point too few. If so, repeat final value and append.
-      # Repeating the final value keeps spectra smooth when computing PSDs.
-      if len(tr.data) - 86400 == -1: 
-        last_val = tr.data[-1]
-        tr.data = np.append(tr.data, last_val)
-
-    # Grab station depth in meters (I like depth positive down)
-    h = trZ.stats.sac.stel * -1
-
-    ############ COMPUTATION OF AUTO- AND CROSS-SPECTRAL DENSITIES #############
-    ################## CODE BELOW TAKEN DIRECTLY FROM OBStools #################
-
-    # Credit to Pascal Audet and Helen Janizsewski et al.
-
-    # Spectral QC.
-    dt = trP.stats.sampling_rate                     # Station sampling [Hz]
-    fs = trP.stats.delta                             # Station sampling [s]
-    wlen_samples = int(wlen_sec / dt)                # Window length [samples]
-    olap_samples = int(wlen_sec * olap_percent / dt) # Number overlap points
-    
-    # Construct a Hanning window with 2x the number of overlap samples.
-    hanning = np.hanning(2 * olap_samples)
-    window = np.ones(wlen_samples)
-    window[0:olap_samples] = hanning[0:olap_samples]
-    window[-olap_samples:wlen_samples] = hanning[olap_samples:wlen_samples]
-    
-    PSDs = []
-    for tr in traces:
-      f, t, psd = spectrogram(tr.data, fs, window=window, nperseg=wlen_samples, noverlap=olap_samples)
-      PSDs.append(psd)
-   
-    # Select bandpass frequencies.
-    ff = (f > 0.004) & (f < 2.0)
-
-    # Smoothing
-    for i, psd in enumerate(PSDs):
-      
-      # I added this check - SM. Need to handle zeros in psds, otherwise they
-      # become problematic down the line. Set zeros to smallest nonzero value. 
-      zero_check = np.sort(psd.flatten())
-      if (zero_check == 0).any():
-        smallest_non_zero = zero_check[zero_check != 0][0]
-        psd[psd == 0] = smallest_non_zero 
-
-      PSDs[i] = smooth.smooth(np.log(psd), 50, axis=0)
-
-    # Remove mean of the log PSDs.
-    for i, psd in enumerate(PSDs):
-      PSDs[i] = psd[ff, :] - np.mean(psd[ff, :], axis=0)
-  
-    # Cycle through to kill high-std-norm windows.
-    moveon = False
-    good = np.repeat([True], len(t))
-    indwin = np.argwhere(good == True)
-    while moveon == False:
-      ubernorm = np.empty((len(PSDs), np.sum(good)))
-      for ind_u, psd in enumerate(PSDs):
-        normvar = np.zeros(np.sum(good))
-        for ii, tmp in enumerate(indwin):
-          ind = np.copy(indwin)
-          ind = np.delete(ind, ii)
-          normvar[ii] = norm(np.std(psd[:, ind], axis=1), ord=2)
-        ubernorm[ind_u, :] = np.median(normvar) - normvar
-      penalty = np.sum(ubernorm, axis=0)
-      kill = penalty > 2.0 * np.std(penalty)
-      if np.sum(kill) == 0:
-        moveon = True
-
-      trypenalty = penalty[np.argwhere(kill == False)].T[0]
-      if ftest.ftest(penalty, 1, trypenalty, 1) < 0.05:
-        good[indwin[kill == True]] = False
-        indwin = np.argwhere(good == True)
-        moveon = False
-      else:
-        moveon = True
+# Parallel processing.
+workers = 1          # number of worker processes (1 processes days serially)
+prefetch = 2         # number of days to read ahead when processing serially
+
+##################################### MAIN #####################################
 
-    if np.sum(good) < minwin:
-      print("Too few good data segments to calculate average day spectra")
+# Guard needed so worker processes can import this script safely.
+if __name__ == '__main__':
+
+  # Index the files to be processed by station, day (time-key) and channel.
+  index = ingest.index(input_dir, cache_dir + 'sac_index.pkl')
+
+  # Build a list of tasks, one for each day (time-key) of each station.
+  tasks = []
+  for stn in sorted(index):
+
+    # Determine the days (time-keys) during which the station has data.
+    stn_tks = sorted(index[stn])
+
+    # Skip days that are already in the station's archive.
+    if use_archive:
+      done = archive.tks(output_dir + stn + '/')
+      stn_tks = [tk for tk in stn_tks if tk not in done]
+
+    # Grab the files of each day. When writing archives, workers hand results
+    # back rather than writing them (None).
+    for tk in stn_tks:
+      current_day_fles = ingest.day_files(index[stn][tk])
+      tasks.append((stn, tk, current_day_fles,
+                    None if use_archive else output_dir, wlen_sec,
+                    olap_percent, minwin))
+
+  # Process the station-days, in parallel if desired. Results come back in
+  # order, so days are appended to the archives in order, by this process only.
+  print('Processing', len(tasks), 'station-days with', workers, 'worker(s).')
+  start = time.time()
+  # The pool is terminated if anything goes wrong (including Ctrl-C), so no
+  # worker processes are left behind.
+  pool = multiprocessing.Pool(workers) if workers > 1 else None
+  try:
+    if pool is not None:
+      results = pool.imap(daily.process_day, tasks)
     else:
-      print("{0} good windows. Proceeding...".format(np.sum(good)))
-    
-    # Compute spectra for each OBS component.
-    ss = int(wlen_samples * (1 - olap_percent) / dt)
-    ftP, f = fourier.calculate_windowed_fft(trP, wlen_samples, ss)
-    ft1, f = fourier.calculate_windowed_fft(tr1, wlen_samples, ss)
-    ft2, f = fourier.calculate_windowed_fft(tr2, wlen_samples, ss)
-    ftZ, f = fourier.calculate_windowed_fft(trZ, wlen_samples, ss)
-
-    # Compute auto-spectral quantities for good windows.
-    cPP = np.abs(np.mean(ftP[good, :]*np.conj(ftP[good, :]), axis=0))[0:len(f)]
-    c11 = np.abs(np.mean(ft1[good, :]*np.conj(ft1[good, :]), axis=0))[0:len(f)]
-    c22 = np.abs(np.mean(ft2[good, :]*np.conj(ft2[good, :]), axis=0))[0:len(f)]
-    cZZ = np.abs(np.mean(ftZ[good, :]*np.conj(ftZ[good, :]), axis=0))[0:len(f)]
-
-    # Compute cross-spectral densities for good windows.
-    c12 = np.mean(ft1[good, :]*np.conj(ft2[good, :]), axis=0)[0:len(f)]
-    c1Z = np.mean(ft1[good, :]*np.conj(ftZ[good, :]), axis=0)[0:len(f)]
-    c2Z = np.mean(ft2[good, :]*np.conj(ftZ[good, :]), axis=0)[0:len(f)]
-    c1P = np.mean(ft1[good, :]*np.conj(ftP[good, :]), axis=0)[0:len(f)]
-    c2P = np.mean(ft2[good, :]*np.conj(ftP[good, :]), axis=0)[0:len(f)]
-    cZP = np.mean(ftZ[good, :]*np.conj(ftP[good, :]), axis=0)[0:len(f)]
-
-    ##################### WRITE TO DICT. AND STORE TO DISK #####################
-    
-    # Dictionary of spectral quantities plus some helpful parameters.
-    spectral_components = {'cPP': cPP,
-                           'c11': c11,
-                           'c22': c22,
-                           'cZZ': cZZ,
-                           'c12': c12,
-                           'c1Z': c1Z,
-                           'c2Z': c2Z,
-                           'c1P': c1P,
-                           'c2P': c2P,
-                           'cZP': cZP,
-                           'freqs': f,
-                           'depth': h,
-                           'npts': len(cPP),
-                           'stn': stn,
-                           'tk':tk}
-    
-    # Write spectral quantities for current stn,day to disk as a .pkl file.
-    pickle.dump(spectral_components, open(output_dir+stn+'_'+tk+'.pkl','wb'))
\ No newline at end of file
+      results = map(daily.process_day, ingest.prefetch(tasks, prefetch))
+
+    # Report progress as days finish, and keep track of the days that failed.
+    failed = []
+    for i, (stn, tk, ok, message, spectral_components) in enumerate(results):
+      elapsed = time.time() - start
+      print('[{0}/{1}, {2:.0f}s]'.format(i + 1, len(tasks), elapsed), stn, tk)
+      if ok:
+        print(message)
+      else:
+        print('Failed!\n' + message)
+        failed.append((stn, tk))
+
+      # Append the day to the station's archive. Spectral densities are stored
+      # one row per day, everything else is constant for the station.
+      if ok and use_archive:
+        rows = {key: [value] for key, value in spectral_components.items()
+                if key[0] == 'c'}
+        meta = {key: spectral_components[key]
+                for key in ['freqs', 'depth', 'npts', 'stn']}
+        archive.append(output_dir + stn + '/', [tk], rows, meta)
+
+    if pool is not None:
+      pool.close()
+      pool.join()
+  finally:
+    if pool is not None:
+      pool.terminate()
+
+  # Summary.
+  print('Done.', len(tasks) - len(failed), 'of', len(tasks), 'station-days ok.')
+  for stn, tk in failed:
+    print('Failed:', stn, tk)
\ No newline at end of file
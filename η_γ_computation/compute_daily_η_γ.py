@@ -9,6 +9,13 @@ coherence γ signals for each station, for each day.
 
 The η and γ data are stored in a Python dictionary and written to disk.
 
+By default, the spectral quantities are instead read from per-station archives
+(see utils/archive.py), and η and γ are computed for all of a station's days in
+one vectorized pass. They are appended to a per-station archive of their own,
+holding (days x freqs) arrays of η and γ, along with the frequencies, station
+depth, and the time-keys of the days. Only days not already in the η and γ
+archive are computed, so the script can be re-run as new data comes in.
+
 Daily η and γ curves can be plotted and saved to disk if desired. I find this
 extremely helpful, as it facilitates a quick check that everything is working
 properly. If η and γ look like garbage, something is not working prior to this.
@@ -23,7 +30,7 @@ import pickle
 import numpy as np
 
 # Helper functions.
-from utils import compliance_coherence, fetch, plot, setup
+from utils import archive, compliance_coherence, fetch, gravd, plot, setup
 
 ##################################### SETUP ####################################
 
@@ -37,46 +44,93 @@ setup.directory(plot_dir)
 # Option to create output plots? If so will create plot of η and γ for each day.
 output_plots = True
 
-##################################### MAIN #####################################
+# Read and write per-station archives, computing all days of a station at once?
+# Otherwise, one .pkl file is read and written per station-day.
+use_archive = True
 
-# Store all paths to files to be processed in a Python list.
-fle_paths = fetch.data_paths(input_dir)
+# On-disk cache of IG wavenumbers, which only depend on station depth and
+# frequencies. Set to None to disable.
+gravd_cache = '../data/gravd/'
+gravd.set_cache_dir(gravd_cache)
 
-# Determine the stations that have data to be processed from the list of files.
-stns = np.unique([path.split('/')[-1].split('_')[0] for path in fle_paths])
+##################################### MAIN #####################################
 
-# Loop over stations.
-for stn in stns:
+# Compute η and γ for all new days of each station at once.
+if use_archive:
 
-  # Filter files to only those that belong to the current station.
-  stn_fles = [fle for fle in fle_paths if stn in fle]
+  # Loop over stations that have an archive of spectral quantities.
+  for stn in archive.stations(input_dir):
 
-  # Determine the days (time-keys) during which the station has data.
-  stn_tks = np.unique([fle.split('_')[-1].split('.pkl')[0] for fle in stn_fles])
-  
-  # Loop and process data during days/time-keys that the station has data.
-  for tk in stn_tks:
+    # Determine the days (time-keys) that haven't been processed yet.
+    tks, spectra, meta = archive.read(input_dir + stn + '/')
+    new = ~np.isin(tks, archive.tks(output_dir + stn + '/'))
 
     # Handy print statement.
-    print(stn, tk)
+    print(stn, np.sum(new), 'new days')
+    if not new.any():
+      continue
 
-    # Filter the the stn_fles to only those files during the current day.
-    current_spectra = [fle for fle in stn_fles if tk in fle][0]
+    # Stack the spectral components of the new days.
+    spectral_stack = {key: spectra[key][new] for key in spectra}
+    freqs = meta['freqs']
+    depth = meta['depth']
+    spectral_stack['freqs'] = freqs
+    spectral_stack['depth'] = depth
 
-    # Load dictionary containing current spectral quantities.
-    spectral_components = pickle.load(open(current_spectra, 'rb'))
+    # Compute coherence and normalized compliance for all days in one pass.
+    ηs, γs = compliance_coherence.η_γ(spectral_stack)
 
-    # Extract frequency information and station depth from spectral dictionary.
-    freqs = spectral_components['freqs']
-    depth = spectral_components['depth']
+    # Append the new days to the station's η and γ archive.
+    archive.append(output_dir + stn + '/', tks[new], {'η': ηs, 'γ': γs},
+                   {'freqs': freqs, 'depth': depth, 'stn': stn})
 
-    # Compute coherence and normalized compliance from the daily spectral comps.
-    η, γ = compliance_coherence.η_γ(spectral_components)
+    # Plot η and γ for each new day if desired.
+    if output_plots:
+      for j, tk in enumerate(tks[new]):
+        plot.η_γ_curves(freqs, depth, stn, tk, ηs[j], γs[j], plot_dir)
 
-    # Store η and γ in a dictionary. Write to disk.
-    data = {'η': η, 'γ': γ, 'freqs': freqs, 'depth': depth, 'stn': stn, 'tk':tk}
-    pickle.dump(data, open(output_dir + stn + '_' + tk + '.pkl','wb')) 
+# Otherwise, process one day at a time.
+else:
 
-    # Plot the current η and γ for the current station if desired.
-    if output_plots:
-      plot.η_γ_curves(freqs, depth, stn, tk, η, γ, plot_dir)
+  # Store all paths to files to be processed in a Python list. Only per-day
+  # files, named <stn>_<YYYY-MM-DDThh:mm>.pkl, match.
+  fle_paths = fetch.data_paths(input_dir, '*_????-??-??T??:??.pkl')
+
+  # Determine the stations that have data to be processed from the files.
+  stns = np.unique([path.split('/')[-1].split('_')[0] for path in fle_paths])
+
+  # Loop over stations.
+  for stn in stns:
+
+    # Filter files to only those that belong to the current station.
+    stn_fles = [fle for fle in fle_paths if stn in fle]
+
+    # Determine the days (time-keys) during which the station has data.
+    stn_tks = np.unique([fle.split('_')[-1].split('.pkl')[0] for fle in stn_fles])
+
+    # Loop and process data during days/time-keys that the station has data.
+    for tk in stn_tks:
+
+      # Handy print statement.
+      print(stn, tk)
+
+      # Filter the the stn_fles to only those files during the current day.
+      current_spectra = [fle for fle in stn_fles if tk in fle][0]
+
+      # Load dictionary containing current spectral quantities.
+      spectral_components = pickle.load(open(current_spectra, 'rb'))
+
+      # Extract frequency information and station depth from spectral dict.
+      freqs = spectral_components['freqs']
+      depth = spectral_components['depth']
+
+      # Compute coherence and normalized compliance from daily spectral comps.
+      η, γ = compliance_coherence.η_γ(spectral_components)
+
+      # Store η and γ in a dictionary. Write to disk.
+      data = {'η': η, 'γ': γ, 'freqs': freqs, 'depth': depth, 'stn': stn, 'tk':tk}
+      pickle.dump(data, open(output_dir + stn + '_' + tk + '.pkl','wb')) 
+
+      # Plot the current η and γ for the current station if desired.
+      if output_plots:
+        plot.η_γ_curves(freqs, depth, stn, tk, η, γ, plot_dir)
\ No newline at end of file
@@ -0,0 +1,119 @@
+'''
+FUNCTION SET archive.py
+
+Functions to store per-day results for a station in a single consolidated
+archive, rather than as one pickle per station-day.
+
+An archive is a directory (e.g. ../data/spectral/daily_η_γ/M08A/) holding:
+
+  - index.pkl  - the time-keys of the days in the archive (in the order they
+                 were appended), the dtype and shape of each field, and a
+                 dictionary of metadata that is constant for the station
+                 (frequencies, depth, etc.)
+  - <key>.bin  - one raw binary file per field (e.g. η.bin), holding one row per
+                 day, appended to as new days come in
+
+Fields are read back with np.memmap, so reading all days of a multi-year
+deployment is one read per field rather than one unpickle per day. Rows are
+always written before the index is updated, so an interrupted append leaves
+the archive as it was. Only one process should write to an archive at a time.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# The usual.
+import os
+import glob
+import pickle
+import numpy as np
+
+################################## FUNCTIONS ###################################
+
+def stations(root_dir):
+  '''
+  Names of the stations with an archive in root_dir, sorted alphabetically.
+  '''
+  paths = glob.glob(root_dir + '*/index.pkl')
+  return sorted(path.split('/')[-2] for path in paths)
+
+def index(archive_dir):
+  '''
+  Load the index of an archive. An archive that doesn't exist yet has an empty
+  index.
+  '''
+  path = archive_dir + 'index.pkl'
+  if not os.path.exists(path):
+    return {'tks': [], 'fields': {}, 'meta': {}}
+  return pickle.load(open(path, 'rb'))
+
+def tks(archive_dir):
+  '''
+  Time-keys of the days stored in an archive, in the order they were appended.
+  '''
+  return index(archive_dir)['tks']
+
+def append(archive_dir, new_tks, rows, meta=None):
+  '''
+  Append days to an archive, creating it if needed. new_tks is a list of
+  time-keys, and rows is a dictionary of arrays with one row per time-key. All
+  appends to an archive must have the same fields, dtypes and row shapes. meta
+  is an optional dictionary of station metadata, merged into the index.
+  '''
+  if len(new_tks) == 0:
+    return
+  idx = index(archive_dir)
+  n = len(idx['tks'])
+
+  # Days can only be added once.
+  duplicates = set(idx['tks']) & set(new_tks)
+  if len(duplicates) > 0:
+    raise ValueError('Days already in ' + archive_dir + ': ' +
+                     ', '.join(sorted(duplicates)))
+
+  # Check the rows match the fields already in the archive.
+  fields = {key: (np.asarray(row).dtype.str, np.shape(row)[1:])
+            for key, row in rows.items()}
+  if n > 0 and fields != idx['fields']:
+    raise ValueError('Fields do not match those in ' + archive_dir)
+
+  # Write the rows. Anything past the last indexed row was left behind by an
+  # interrupted append, and is overwritten.
+  os.makedirs(archive_dir, exist_ok=True)
+  for key, row in rows.items():
+    row = np.ascontiguousarray(row, dtype=fields[key][0])
+    mode = 'r+b' if os.path.exists(archive_dir + key + '.bin') else 'wb'
+    with open(archive_dir + key + '.bin', mode) as f:
+      f.seek(n * row[0].nbytes)
+      f.truncate()
+      f.write(row.tobytes())
+
+  # Then update the index.
+  idx['tks'] = idx['tks'] + [str(tk) for tk in new_tks]
+  idx['fields'] = fields
+  idx['meta'].update(meta or {})
+  tmp = archive_dir + 'index.pkl.tmp'
+  pickle.dump(idx, open(tmp, 'wb'))
+  os.replace(tmp, archive_dir + 'index.pkl')
+
+def read(archive_dir, keys=None, mmap_mode='r'):
+  '''
+  Read the fields (all, or only keys) of an archive. Returns the time-keys, a
+  dictionary of (days, ...) arrays memory-mapped with mmap_mode, and the
+  station metadata.
+  '''
+  idx = index(archive_dir)
+  n = len(idx['tks'])
+  keys = idx['fields'].keys() if keys is None else keys
+
+  data = {}
+  for key in keys:
+    dtype, shape = idx['fields'][key]
+    if n == 0:
+      data[key] = np.zeros((0,) + shape, dtype=dtype)
+    else:
+      data[key] = np.memmap(archive_dir + key + '.bin', dtype=dtype,
+                            mode=mmap_mode, shape=(n,) + shape)
+
+  return np.array(idx['tks']), data, idx['meta']
\ No newline at end of file
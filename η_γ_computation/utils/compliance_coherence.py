@@ -4,6 +4,10 @@ FUNCTION compliance_coherence.py
 A function to compute η and γ for an OBS from its auto- and cross-spectral
 densities.
 
+Everything is computed element-wise, so η_γ() works equally well on a single day
+of spectral components or on (days x freqs) stacks of them, in which case all
+daily η and γ curves are computed in one pass with one shared wavenumber vector.
+
 This code borrowed from OBStools (https://github.com/nfsi-canada/OBStools) with
 minor modifications. 
 
@@ -17,9 +21,13 @@ import numpy as np
 # Additional helper functions.
 from utils import gravd, spectral
 
-################################### FUNCTION ###################################
+################################## FUNCTIONS ###################################
 
 def η_γ(spectral_components):
+  '''
+  Compute η and γ from the auto- and cross-spectral densities of one day, or
+  from a stack of days. Returns arrays shaped like the spectral densities.
+  '''
   
   # Access frequency and depth information from spectral components.
   freqs = spectral_components['freqs']
@@ -27,7 +35,7 @@ def η_γ(spectral_components):
 
   # Calculate wavenumbers for this station depth.
   ω = 2 * np.pi * freqs
-  k = gravd.gravd(ω, depth)
+  k = gravd.wavenumbers(ω, depth)
 
   # Grab auto- and cross-spectral densities from spectral components.
   cPP = spectral_components['cPP']
@@ -3,6 +3,8 @@ FUNCTION fourier.py
 
 Helper functions to calculate a windowed FFT from an ObsPy Trace obj. as input.
 
+Traces are real, so only the non-negative frequencies are computed (rfft).
+
 Borrowed from OBStools (https://github.com/nfsi-canada/OBStools). 
 '''
 
@@ -29,7 +31,7 @@ def calculate_windowed_fft(trace, ws, ss=None, hann=True):
   Returns
   -------
   ft : :class:`~numpy.ndarray`
-      Fourier transform of trace
+      Fourier transform of trace, at the non-negative frequencies f
   f : :class:`~numpy.ndarray`
       Frequency axis in Hz
   """
@@ -41,9 +43,28 @@ def calculate_windowed_fft(trace, ws, ss=None, hann=True):
   tr, nd = sliding_window.sliding_window(trace.data, ws, ss)
   
   # Fourier transform
-  ft = np.fft.fft(tr, n=n2)
+  ft = np.fft.rfft(tr, n=n2)
   
   return ft, f
 
+def window_means(trace, ws, ss=None):
+  """
+  Calculates the mean of each of the windows of calculate_windowed_fft()
+  Parameters
+  ----------
+  trace : :class:`~obspy.core.Trace`
+      Input trace data
+  ws : int
+      Window size, in number of samples
+  ss : int
+      Step size, or number of samples until next window
+  Returns
+  -------
+  : :class:`~numpy.ndarray`
+      Mean of the (untapered) data in each window
+  """
+  tr, nd = sliding_window.sliding_window(trace.data, ws, ss, hann=False)
+  return np.mean(tr, axis=-1)
+
 def _npow2(x):
   return 1 if x == 0 else 2**(x-1).bit_length()
\ No newline at end of file
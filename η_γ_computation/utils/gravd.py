@@ -17,6 +17,16 @@ a novel approach and used a rational approximation of tanh(x) to solve for k(ω)
 The rational approximation is always better than the shallow approximation. 
 However, it's only better than the deep approximation if k*H < 2.96.
 
+The resulting quartic in k only has even powers, i.e. it's a quadratic in k^2,
+so it's solved in closed form for all frequencies (and depths) at once. If
+desired, the result can then be refined with Newton's method on the exact
+dispersion relation.
+
+The same depth and frequency grid come up over and over (every day of data at a
+station, every model at a station), so wavenumbers() wraps gravd() with a small
+LRU cache in memory, and optionally a cache on disk (set cache_dir) so repeated
+runs only pay for each station once.
+
 For details refer to:
 
 Mosher, S. G., Audet, P., & Gosselin, J. M. (2021).
@@ -30,56 +40,118 @@ Stephen Mosher, Mar. 2022
 #################################### IMPORTS ###################################
 
 # The usual.
+import os
+import hashlib
 import numpy as np
-import numpy.polynomial as poly
-
-################################### FUNCTION ###################################
-
-def gravd(ω, H):
+from collections import OrderedDict
+
+################################## FUNCTIONS ###################################
+
+def gravd(ω, H, exact=False, max_iter=20, rtol=1e-12):
+  '''
+  Wavenumber k(ω) of infragravity waves for angular frequencies ω at station
+  depth(s) H. ω and H can be scalars or arrays that broadcast against each
+  other, e.g. gravd(ω[np.newaxis, :], H[:, np.newaxis]) for many depths at
+  once. If exact is True, k is refined with Newton's method until it solves
+  ω^2 = g k tanh(kH) to within a relative step of rtol.
+  '''
   
   g = 9.79329 # gravitational accel. for oceanic contexts
-  N = len(ω)
+  ω = np.asarray(ω, dtype=float)
+  H = np.asarray(H, dtype=float)
 
   # Deep water approximation for k.
   k_deep = ω**2 / g
 
-  # Initialize values of k to be solved.
-  k = np.zeros(len(ω))
-
   # The rational approximation to tanh(x) leads to a quartic polynomial in the
-  # IG dispersion relation. We solve this using poly from numpy.polynomial.
-  # Conveniently, the resulting polynomial always has real roots, and now we 
-  # aren't restricted to considering deep and shallow cases seperately. Poly 
-  # requires we break the resulting polynomial into terms of increasing order.
+  # IG dispersion relation. Conveniently, it has no odd terms, so it's a
+  # quadratic a4*x^2 + a2*x + a0 = 0 in x = k^2, and now we aren't restricted
+  # to considering deep and shallow cases seperately.
 
   a0 = -27 * ω**2 / g                   # constant terms
-  a1 = np.zeros(len(ω))                 # no linear terms
   a2 = 27 * H - (9 * ω**2 * H**2)/g     # quadratic terms
-  a3 = np.zeros(len(ω))                 # no cubic terms
-  a4 = np.ones(len(ω)) * H**3           # quartic terms
-
-  # Loop over angular frequencies and compute wavenumber for each.
-  for i in range(len(ω)):
-
-    # Case when ω = 0
-    if ω[i] == 0:
-      k[i] = 0
-
-    # Othwerise  
-    else:
-      p = poly.Polynomial([a0[i], a1[i], a2[i], a3[i], a4[i]])
-      solu = poly.Polynomial.roots(p)
-      positive_roots = solu[solu > 0]
-
-      # By default we get 4 complex numbers as results, so we force the
-      # real roots (i.e. those with imaginary comp == 0) to be purely real
-      # numbers.
-      real_positive_root = positive_roots[positive_roots.imag == 0].real[0]
-      k[i] = real_positive_root
+  a4 = H**3                             # quartic terms
+
+  # Since a0 <= 0 < a4 there's exactly one non-negative root x, i.e. exactly
+  # one positive real root k. Pick the form of the quadratic formula that
+  # avoids cancellation for the sign of a2.
+  disc = np.sqrt(a2**2 - 4 * a4 * a0)
+  with np.errstate(divide='ignore', invalid='ignore'):
+    x = np.where(a2 > 0, 2 * a0 / (-a2 - disc), (-a2 + disc) / (2 * a4))
+
+  # Case when ω = 0
+  k = np.where(ω == 0, 0.0, np.sqrt(np.abs(x)))
   
   # For k*H >= 2.96, prefer the deep approximation.
-  for j, wavenumber in enumerate(k_deep):
-    if wavenumber * H > 2.96:
-      k[j] = k_deep[j]
+  k = np.where(k_deep * H > 2.96, k_deep, k)
+
+  # Optionally refine with Newton's method on the exact dispersion relation,
+  # f(k) = g k tanh(kH) - ω^2. The ω = 0 case (f'(0) = 0) is left at k = 0.
+  if exact:
+    for i in range(max_iter):
+      t = np.tanh(k * H)
+      f = g * k * t - ω**2
+      df = g * (t + k * H * (1 - t**2))
+      step = np.divide(f, df, out=np.zeros(np.broadcast(f, df).shape),
+                       where=df > 0)
+      k = k - step
+      if np.all(np.abs(step) <= rtol * k):
+        break
   
-  return k
\ No newline at end of file
+  return k
+
+def wavenumbers(ω, H, exact=False, cache_dir=None):
+  '''
+  Cached version of gravd(). Results are keyed by the depth(s) H and a hash of
+  the frequency grid ω, and returned as read-only arrays. The most recently
+  used cache_size results are kept in memory. If cache_dir (or the module level
+  default set with set_cache_dir()) is set, results are also stored there as
+  .npy files.
+  '''
+
+  # Key on the exact bytes of the inputs, so any change to the grid is a miss.
+  ω = np.ascontiguousarray(ω, dtype=float)
+  H = np.ascontiguousarray(H, dtype=float)
+  key = hashlib.sha1(b'%r %r %r' % (ω.shape, H.shape, exact) + ω.tobytes() +
+                     H.tobytes()).hexdigest()
+
+  # Check memory first.
+  if key in _cache:
+    _cache.move_to_end(key)
+    return _cache[key]
+
+  # Then disk, and only then compute from scratch.
+  cache_dir = _cache_dir if cache_dir is None else cache_dir
+  path = None if cache_dir is None else os.path.join(cache_dir, key + '.npy')
+  if path is not None and os.path.exists(path):
+    k = np.load(path)
+  else:
+    k = gravd(ω, H, exact)
+    if path is not None:
+      # Write to a temporary file first so parallel runs never see half a file.
+      os.makedirs(cache_dir, exist_ok=True)
+      tmp = path + '.' + str(os.getpid())
+      with open(tmp, 'wb') as f:
+        np.save(f, k)
+      os.replace(tmp, path)
+
+  # Remember, evicting the least recently used result if full.
+  k.setflags(write=False)
+  _cache[key] = k
+  while len(_cache) > cache_size:
+    _cache.popitem(last=False)
+  return k
+
+################################ CACHE SETTINGS ################################
+
+cache_size = 128  # Max number of (depth, frequency grid) results kept in memory
+_cache_dir = None # Default on-disk cache directory, see set_cache_dir()
+_cache = OrderedDict()
+
+def set_cache_dir(cache_dir):
+  '''
+  Set the default on-disk cache directory used by wavenumbers(). None disables
+  the on-disk cache.
+  '''
+  global _cache_dir
+  _cache_dir = cache_dir
\ No newline at end of file
@@ -0,0 +1,129 @@
+'''
+FUNCTION SET ingest.py
+
+A set of functions to find and read the .SAC files of OBS data.
+
+Rather than scanning the full list of files for every station and every day,
+index() parses every file name once into a (station, day, channel) index,
+
+  {stn: {tk: {channel: path}}}
+
+and caches it on disk. The cached index is reused until files are added to or
+removed from the data directory.
+
+File names are expected to look like those of the YL network data, e.g.
+
+  2012-10-01T00:00:00YL.<...>.<...>.<...>.<...>.<...>.M08A.<...>.BHZ.SAC
+
+i.e. the time-key comes before 'YL', and splitting on '.' the station is the
+7th field and the channel the 9th.
+
+read_day() reads the traces of one station-day (channels() gives their channels,
+and label() the component each one records), and prefetch() reads the
+traces of upcoming days on a pool of threads while the current day is being
+processed.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# The usual.
+import os
+import pickle
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from obspy import read
+
+################################## FUNCTIONS ###################################
+
+def parse(path):
+  '''
+  Parse the station, time-key (day) and channel from the name of a .SAC file.
+  '''
+  fname = os.path.basename(path)
+  stn = fname.split('.')[6]
+  tk = fname.split('YL')[0].split(':')[0] + ':00'
+  channel = fname.split('.')[8]
+  return stn, tk, channel
+
+def index(data_dir, cache_path=None):
+  '''
+  Build the {stn: {tk: {channel: path}}} index of the files in data_dir. If
+  cache_path is given, the index is stored there, and reused as long as the
+  modification time and number of files of data_dir haven't changed.
+  '''
+
+  # Listing the directory is cheap, parsing every name isn't.
+  fnames = sorted(os.listdir(data_dir))
+  key = (os.stat(data_dir).st_mtime_ns, len(fnames))
+
+  # Reuse the cached index if the directory hasn't changed.
+  if cache_path is not None and os.path.exists(cache_path):
+    cached = pickle.load(open(cache_path, 'rb'))
+    if cached['key'] == key:
+      return cached['index']
+
+  # Otherwise parse every file name once.
+  idx = {}
+  for fname in fnames:
+    stn, tk, channel = parse(fname)
+    idx.setdefault(stn, {}).setdefault(tk, {})[channel] = data_dir + fname
+
+  if cache_path is not None:
+    pickle.dump({'key': key, 'index': idx}, open(cache_path, 'wb'))
+
+  return idx
+
+def day_files(day):
+  '''
+  Paths of the files of one station-day (a {channel: path} entry of the index)
+  sorted by channel. For the YL data this gives the order P, 1, 2, Z.
+  '''
+  return [day[channel] for channel in sorted(day)]
+
+def channels(day_fles):
+  '''
+  Channels of the files of one station-day, in the order that read_day() reads
+  them.
+  '''
+  return sorted(parse(path)[2] for path in day_fles)
+
+def label(channel):
+  '''
+  Component label of a channel, as used to name spectral densities (e.g. c1P):
+  'P' for a pressure channel (instrument code 'D', e.g. BDH), otherwise the
+  orientation code (e.g. '1', '2' and 'Z' for BH1, BH2 and BHZ).
+  '''
+  return 'P' if channel[1] == 'D' else channel[-1]
+
+def read_day(day_fles):
+  '''
+  Read the traces of one station-day, as a list of ObsPy Trace Objects, in the
+  order of the channels of the files (see day_files()).
+  '''
+  day_fles = sorted(day_fles, key=lambda path: parse(path)[2])
+  return [read(fle)[0] for fle in day_fles]
+
+def prefetch(tasks, ahead=2):
+  '''
+  Given an iterable of tasks, tuples whose third element is the list of files of
+  a station-day, yield each task with the day's traces appended, while the
+  traces of up to ahead upcoming days are read on a pool of threads. If reading
+  fails, None is appended instead, and it's up to the consumer to deal with it.
+  '''
+  with ThreadPoolExecutor(max_workers=ahead) as executor:
+    queue = deque()
+    for task in tasks:
+      queue.append((task, executor.submit(read_day, task[2])))
+      if len(queue) > ahead:
+        yield _result(*queue.popleft())
+    while queue:
+      yield _result(*queue.popleft())
+
+def _result(task, future):
+  try:
+    traces = future.result()
+  except Exception:
+    traces = None
+  return task + (traces,)
\ No newline at end of file
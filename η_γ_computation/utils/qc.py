@@ -0,0 +1,78 @@
+'''
+FUNCTION SET qc.py
+
+Functions to QC the windows that make up a day of OBS data, by rejecting
+windows whose PSDs stand out from the rest of the day.
+
+For each component, the PSDs of the day's windows are compared by the norm of
+the standard deviation (across windows) of the PSDs with one window left out.
+Leaving out an anomalous window reduces that norm more than leaving out a
+typical one. Windows that stand out are killed, and this is repeated for as
+long as an F-test says killing them significantly reduces the penalty.
+
+The logic is the same as in OBStools (https://github.com/nfsi-canada/OBStools),
+but rather than recomputing the standard deviation from scratch with each window
+left out, all leave-one-out standard deviations are computed at once from the
+sums and sums of squares over windows, for all components together.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# The usual.
+import numpy as np
+
+# Helper functions.
+from utils import ftest
+
+################################## FUNCTIONS ###################################
+
+def leave_one_out_std_norm(psd):
+  '''
+  Given PSDs with windows along the last axis, e.g. (F, W) or (C, F, W) for C
+  components, return the L2 norm over frequency of the standard deviation
+  across windows, computed with each window in turn left out. Returns an array
+  of shape (W,) or (C, W).
+  '''
+
+  # Center first, which doesn't change standard deviations but keeps the sums
+  # of squares from losing precision.
+  psd = psd - np.mean(psd, axis=-1, keepdims=True)
+  n = psd.shape[-1] - 1
+
+  # Mean and variance over the other n windows, for each window left out.
+  S1 = np.sum(psd, axis=-1, keepdims=True)
+  S2 = np.sum(psd**2, axis=-1, keepdims=True)
+  μ = (S1 - psd) / n
+  var = np.maximum((S2 - psd**2) / n - μ**2, 0)
+
+  # The L2 norm of the standard deviation over frequency.
+  return np.sqrt(np.sum(var, axis=-2))
+
+def good_windows(PSDs, alpha=0.05):
+  '''
+  Flag the good windows of a day of data. PSDs is a list (or stack) of
+  mean-removed log PSDs of shape (F, W), one for each component. Windows are
+  killed while an F-test on the penalties gives P < alpha. Returns a boolean
+  array of shape (W,).
+  '''
+  PSDs = np.asarray(PSDs)
+
+  # Cycle through to kill high-std-norm windows.
+  good = np.repeat([True], PSDs.shape[-1])
+  moveon = False
+  while moveon == False:
+    indwin = np.flatnonzero(good)
+    normvar = leave_one_out_std_norm(PSDs[..., indwin])
+    ubernorm = np.median(normvar, axis=-1, keepdims=True) - normvar
+    penalty = np.sum(ubernorm, axis=0)
+    kill = penalty > 2.0 * np.std(penalty)
+
+    trypenalty = penalty[kill == False]
+    if np.sum(kill) > 0 and ftest.ftest(penalty, 1, trypenalty, 1) < alpha:
+      good[indwin[kill]] = False
+    else:
+      moveon = True
+
+  return good
\ No newline at end of file
@@ -4,6 +4,16 @@ FUNCTION statistics.py
 A function to compute 95% statistics from a set of η and γ curves recorded by an
 OBS
 
+There are three ways to find the 2.5 and 97.5% levels at each frequency:
+
+  - 'interp'    - sort all observations and linearly interpolate (default)
+  - 'partition' - the same levels, but only partially sorting the observations
+                  with np.partition, which is much faster for large stacks
+  - 'sketch'    - stream the observations a chunk of days at a time through a
+                  quantile sketch (see sketch.py), so stacks that don't fit in
+                  memory (e.g. memory-mapped archives) can be used. The levels
+                  are approximate, with a bound on their rank error
+
 Stephen Mosher, Mar. 2022
 '''
 #################################### IMPORTS ###################################
@@ -11,46 +21,107 @@ Stephen Mosher, Mar. 2022
 import numpy as np
 from scipy.interpolate import interp1d
 
-################################### FUNCTION ###################################
+# Helper functions.
+from utils import sketch
 
-def statistics(μ_η, μ_γ, η_observed, γ_observed):
+################################### FUNCTIONS ##################################
 
-  # Sort observations of η at each frequency.
-  sorted_η = np.sort(η_observed, axis=0)
+def statistics(μ_η, μ_γ, η_observed, γ_observed, method='interp',
+               chunk=10000, return_error=False):
+  '''
+  2.5 and 97.5% limits of the observed (days x freqs) ηs and γs at each
+  frequency, scaled by the mean signals μ_η and μ_γ. method is 'interp',
+  'partition' or 'sketch' (see above), and chunk is the number of days at a
+  time fed to the sketch. If return_error is True, also returns the bound on
+  the rank error of the limits (0 for the exact methods).
+  '''
+  error = 0.0
 
-  # Interpolate and calculate 2.5 and 97.5 % 
-  interp_η = interp1d(np.linspace(0, 1, len(η_observed)), sorted_η, axis=0)
-  upper_bounds_η = interp_η(0.975)
-  lower_bounds_η = interp_η(0.025)
+  if method == 'interp':
 
-  # Sort observations of γ at each frequency.
-  sorted_γ = np.sort(γ_observed, axis=0)
+    # Sort observations of η at each frequency.
+    sorted_η = np.sort(η_observed, axis=0)
 
-  # Interpolate and calculate 2.5 and 97.5 %
-  interp_γ = interp1d(np.linspace(0, 1, len(γ_observed)), sorted_γ, axis=0)
-  upper_bounds_γ = interp_γ(0.975)
-  lower_bounds_γ = interp_γ(0.025)
+    # Interpolate and calculate 2.5 and 97.5 % 
+    interp_η = interp1d(np.linspace(0, 1, len(η_observed)), sorted_η, axis=0)
+    upper_bounds_η = interp_η(0.975)
+    lower_bounds_η = interp_η(0.025)
 
-  # Ignore the zero frequency term (which will give div by 0 errors), and 
-  # scale the confidence intervals at each frequency by the mean.
-  upper_bounds_η = upper_bounds_η[1:]/μ_η[1:]
-  lower_bounds_η = lower_bounds_η[1:]/μ_η[1:]
+    # Sort observations of γ at each frequency.
+    sorted_γ = np.sort(γ_observed, axis=0)
 
-  # Put the zero frequency term back in.
-  upper_bounds_η = np.insert(upper_bounds_η, 0, 0.0)
-  lower_bounds_η = np.insert(lower_bounds_η, 0, 0.0)
+    # Interpolate and calculate 2.5 and 97.5 %
+    interp_γ = interp1d(np.linspace(0, 1, len(γ_observed)), sorted_γ, axis=0)
+    upper_bounds_γ = interp_γ(0.975)
+    lower_bounds_γ = interp_γ(0.025)
+
+  elif method == 'partition':
+    lower_bounds_η, upper_bounds_η = _partition_levels(η_observed)
+    lower_bounds_γ, upper_bounds_γ = _partition_levels(γ_observed)
+
+  elif method == 'sketch':
+
+    # Stream the observations through a sketch, a chunk of days at a time.
+    sketch_η = sketch.create(η_observed.shape[1])
+    sketch_γ = sketch.create(γ_observed.shape[1])
+    for start in range(0, len(η_observed), chunk):
+      sketch.update(sketch_η, η_observed[start:start + chunk])
+      sketch.update(sketch_γ, γ_observed[start:start + chunk])
+
+    lower_bounds_η, upper_bounds_η = sketch.quantile(sketch_η, [0.025, 0.975])
+    lower_bounds_γ, upper_bounds_γ = sketch.quantile(sketch_γ, [0.025, 0.975])
+    error = max(sketch.error(sketch_η), sketch.error(sketch_γ))
+
+  else:
+    raise ValueError("method must be 'interp', 'partition' or 'sketch'")
+
+  # Scale the confidence intervals at each frequency by the mean.
+  limits_η = limits(lower_bounds_η, upper_bounds_η, μ_η)
+  limits_γ = limits(lower_bounds_γ, upper_bounds_γ, μ_γ)
+
+  if return_error:
+    return (limits_η, limits_γ, error)
+  return (limits_η, limits_γ)
+
+def limits(lower_bounds, upper_bounds, μ):
+  '''
+  Scale lower and upper bounds at each frequency by the mean signal μ, and
+  stack them into an (F, 2) array of limits.
+  '''
 
   # Ignore the zero frequency term (which will give div by 0 errors), and 
   # scale the confidence intervals at each frequency by the mean.
-  upper_bounds_γ = upper_bounds_γ[1:]/μ_γ[1:]
-  lower_bounds_γ = lower_bounds_γ[1:]/μ_γ[1:]
+  upper_bounds = upper_bounds[1:]/μ[1:]
+  lower_bounds = lower_bounds[1:]/μ[1:]
 
   # Put the zero frequency term back in.
-  upper_bounds_γ = np.insert(upper_bounds_γ, 0, 0.0)
-  lower_bounds_γ = np.insert(lower_bounds_γ, 0, 0.0)
+  upper_bounds = np.insert(upper_bounds, 0, 0.0)
+  lower_bounds = np.insert(lower_bounds, 0, 0.0)
 
   # Transpose to give the correct shape. Return.
-  limits_η = np.vstack([lower_bounds_η, upper_bounds_η]).T
-  limits_γ = np.vstack([lower_bounds_γ, upper_bounds_γ]).T
+  return np.vstack([lower_bounds, upper_bounds]).T
 
-  return (limits_η, limits_γ)
\ No newline at end of file
+def _partition_levels(observed, levels=(0.025, 0.975)):
+  '''
+  The same levels as linear interpolation between sorted observations, i.e. at
+  fractional rank q*(n-1), but only partially sorting the observations. Each
+  level needs the observations of rank lo and lo + 1. One partition puts the
+  observation of rank lo + 1 in place (for low levels) or lo (for high levels),
+  and its neighbour is the max (or min) of the short side of the partition.
+  '''
+  n = len(observed)
+  bounds = []
+  for q in levels:
+    rank = q * (n - 1)
+    lo = min(int(np.floor(rank)), n - 2) if n > 1 else 0
+    hi = min(lo + 1, n - 1)
+    if rank < (n - 1) / 2:
+      partitioned = np.partition(observed, hi, axis=0)
+      y0 = np.max(partitioned[:hi], axis=0) if hi > lo else partitioned[lo]
+      y1 = partitioned[hi]
+    else:
+      partitioned = np.partition(observed, lo, axis=0)
+      y0 = partitioned[lo]
+      y1 = np.min(partitioned[hi:], axis=0) if hi > lo else partitioned[lo]
+    bounds.append(y0 + (rank - lo) * (y1 - y0))
+  return bounds
\ No newline at end of file
@@ -0,0 +1,145 @@
+'''
+FUNCTION SET sketch.py
+
+A set of functions for a compact, mergeable quantile sketch (in the spirit of
+KLL sketches) that summarizes a stream of observations at many frequencies at
+once, e.g. daily η or γ curves, in bounded memory.
+
+A sketch is a dictionary holding a list of levels. Level l is an array of
+shape (m_l, F) of retained observations for each of F frequencies, each of
+which stands in for 2^l of the original observations. New observations go into
+level 0. Whenever a level holds more than k observations, they're sorted and
+every other one is promoted to the next level (with twice the weight), the rest
+are discarded. Every frequency sees the same number of observations, so this
+happens for all frequencies in one vectorized step.
+
+Each compaction at level l shifts the rank of any value by at most 2^l, so the
+sketch keeps track of a deterministic bound on the rank error of its quantiles.
+error() returns it as a fraction of the number of observations. Until the
+first compaction the sketch is exact, and quantile() gives the same result as
+linear interpolation between sorted observations.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# The usual.
+import numpy as np
+
+################################## FUNCTIONS ###################################
+
+def create(F, k=256):
+  '''
+  Create an empty sketch for observations at F frequencies, keeping at most k
+  observations per level.
+  '''
+  return {'k': k, 'n': 0, 'err': 0, 'levels': [np.zeros((0, F))],
+          'compactions': [0]}
+
+def update(sketch, observations):
+  '''
+  Add an (N, F) array of observations (e.g. N days) to a sketch, in place.
+  Returns the sketch.
+  '''
+  observations = np.asarray(observations, dtype=float)
+  sketch['levels'][0] = np.concatenate([sketch['levels'][0], observations])
+  sketch['n'] += len(observations)
+  _compact(sketch)
+  return sketch
+
+def merge(a, b):
+  '''
+  Merge two sketches (e.g. of different stations or years) into a new one,
+  that summarizes the observations of both.
+  '''
+  n_levels = max(len(a['levels']), len(b['levels']))
+  F = a['levels'][0].shape[1]
+  merged = create(F, max(a['k'], b['k']))
+  merged['levels'] = [np.zeros((0, F)) for l in range(n_levels)]
+  merged['compactions'] = [0] * n_levels
+  for sketch in [a, b]:
+    for l, level in enumerate(sketch['levels']):
+      merged['levels'][l] = np.concatenate([merged['levels'][l], level])
+      merged['compactions'][l] += sketch['compactions'][l]
+  merged['n'] = a['n'] + b['n']
+  merged['err'] = a['err'] + b['err']
+  _compact(merged)
+  return merged
+
+def quantile(sketch, q):
+  '''
+  Estimate the q-quantile(s) at each frequency. q is a scalar or an array of
+  values between 0 and 1. Returns an (F,) array, or (len(q), F) if q is an
+  array.
+  '''
+
+  # Gather all retained observations and their weights, sorted at each freq.
+  values = np.concatenate(sketch['levels'])
+  weights = np.concatenate([np.full(len(level), 2.0**l)
+                            for l, level in enumerate(sketch['levels'])])
+  order = np.argsort(values, axis=0)
+  values = np.take_along_axis(values, order, axis=0)
+  weights = weights[order]
+
+  # Each retained observation covers a range of ranks. Place it in the middle
+  # of its range, as a fraction of the total. With unit weights this is the
+  # i/(n-1) spacing of linear interpolation between sorted observations.
+  cum_weights = np.cumsum(weights, axis=0)
+  position = (cum_weights - (weights + 1) / 2) / max(sketch['n'] - 1, 1)
+
+  # Linearly interpolate between the retained observations either side of q.
+  q = np.asarray(q, dtype=float)
+  quantiles = np.array([_interp(qi, position, values) for qi in q.ravel()])
+  return quantiles.reshape(q.shape + values.shape[1:])
+
+def error(sketch):
+  '''
+  Upper bound on the rank error of the sketch's quantiles, as a fraction of
+  the number of observations (e.g. 0.01 means a quantile estimate for q lies
+  between the true q - 0.01 and q + 0.01 quantiles), on top of the 1/n
+  resolution that n observations have anyway.
+  '''
+  return sketch['err'] / max(sketch['n'], 1)
+
+def _compact(sketch):
+  '''
+  Promote every other observation of any level holding more than k of them.
+  '''
+  l = 0
+  while l < len(sketch['levels']):
+    level = sketch['levels'][l]
+    if len(level) > sketch['k']:
+
+      # Make room for the next level if needed.
+      if l + 1 == len(sketch['levels']):
+        sketch['levels'].append(np.zeros((0, level.shape[1])))
+        sketch['compactions'].append(0)
+
+      # Keep the largest value if there's an odd number, and promote every
+      # other one of the rest. Alternate which ones, to avoid a bias.
+      level = np.sort(level, axis=0)
+      n_pairs = len(level) // 2
+      offset = sketch['compactions'][l] % 2
+      promoted = level[offset:2 * n_pairs:2]
+      sketch['levels'][l] = level[2 * n_pairs:]
+      sketch['levels'][l + 1] = np.concatenate([sketch['levels'][l + 1],
+                                                promoted])
+      sketch['compactions'][l] += 1
+      sketch['err'] += 2**l
+    l += 1
+
+def _interp(q, position, values):
+  '''
+  Interpolate values to position q, at each frequency (column).
+  '''
+  if len(values) == 1:
+    return values[0]
+  hi = np.clip(np.sum(position < q, axis=0), 1, len(values) - 1)
+  lo = hi - 1
+  x0 = np.take_along_axis(position, lo[np.newaxis], axis=0)[0]
+  x1 = np.take_along_axis(position, hi[np.newaxis], axis=0)[0]
+  y0 = np.take_along_axis(values, lo[np.newaxis], axis=0)[0]
+  y1 = np.take_along_axis(values, hi[np.newaxis], axis=0)[0]
+  t = np.clip((q - x0) / np.where(x1 > x0, x1 - x0, 1), 0, 1)
+  return y0 + t * (y1 - y0)
\ No newline at end of file
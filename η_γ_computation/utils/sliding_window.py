@@ -1,7 +1,8 @@
 '''
 FUNCTION sliding_window.py
 
-Description below.
+Description below. Windows are strided views of the data rather than copies, and
+the Hanning taper is only computed once for each window size.
 
 Borrowed from OBStools (https://github.com/nfsi-canada/OBStools). 
 '''
@@ -10,8 +11,10 @@ Borrowed from OBStools (https://github.com/nfsi-canada/OBStools).
 
 # The usual.
 import numpy as np
+from functools import lru_cache
+from numpy.lib.stride_tricks import sliding_window_view
 
-################################### FUNCTION ###################################
+################################### FUNCTIONS ##################################
 
 def sliding_window(a, ws, ss=None, hann=True):
   """
@@ -40,25 +43,31 @@ def sliding_window(a, ws, ss=None, hann=True):
       # no step size was provided. Return non-overlapping windows
       ss = ws
 
-  # Calculate the number of windows to return, ignoring leftover samples, and
-  # allocate memory to contain the samples
+  # Calculate the number of windows to return, ignoring leftover samples
   valid = len(a) - ss
   nd = (valid) // ss
-  out = np.ndarray((nd, ws), dtype=a.dtype)
 
   if nd == 0:
       if hann:
-          out = a * np.hanning(ws)
+          out = a * _hanning(ws)
       else:
           out = a
+      return out, nd
 
-  for i in range(nd):
-      # "slide" the window along the samples
-      start = i * ss
-      stop = start + ws
-      if hann:
-          out[i] = a[start: stop] * np.hanning(ws)
-      else:
-          out[i] = a[start: stop]
+  # All nd windows must fit in the data (they don't if ss < ws/2)
+  if (nd - 1) * ss + ws > len(a):
+      raise ValueError('Data too short for ' + str(nd) + ' windows of ' +
+                       str(ws) + ' samples with a step of ' + str(ss))
+
+  # "slide" the window along the samples, without copying them
+  out = sliding_window_view(a, ws)[::ss][:nd]
+  if hann:
+      out = (out * _hanning(ws)).astype(a.dtype, copy=False)
+
+  return out, nd
 
-  return out, nd
\ No newline at end of file
+@lru_cache(maxsize=None)
+def _hanning(ws):
+  taper = np.hanning(ws)
+  taper.setflags(write=False)
+  return taper
\ No newline at end of file
@@ -1,7 +1,9 @@
 '''
 FUNCTION smooth.py
 
-Description below.
+Description below. Rather than convolving one row or column at a time, the
+boxcar is applied along the whole axis at once from a cumulative sum, with the
+same edges as np.convolve(..., mode='same').
 
 Borrowed from OBStools (https://github.com/nfsi-canada/OBStools). 
 '''
@@ -33,17 +35,53 @@ def smooth(data, nd, axis=0):
 
   """
   if np.any(data):
-      if data.ndim > 1:
-          filt = np.zeros(data.shape)
-          for i in range(data.shape[::-1][axis]):
-              if axis == 0:
-                  filt[:, i] = np.convolve(
-                      data[:, i], np.ones((nd,))/nd, mode='same')
-              elif axis == 1:
-                  filt[i, :] = np.convolve(
-                      data[i, :], np.ones((nd,))/nd, mode='same')
-      else:
-          filt = np.convolve(data, np.ones((nd,))/nd, mode='same')
-      return filt
+      axis = axis if data.ndim > 1 else 0
+      if data.shape[axis] < nd:
+          # Boxcar longer than the data, where mode='same' changes the length
+          return _smooth_convolve(data, nd, axis)
+      return _smooth_cumsum(data, nd, axis)
   else:
-      return None
\ No newline at end of file
+      return None
+
+def _smooth_cumsum(data, nd, axis):
+  """
+  Boxcar smoothing along axis from a cumulative sum. Output i is the mean of
+  the nd samples ending at i + (nd - 1)//2, with samples beyond either end of
+  the data counting as zero, exactly as for np.convolve(..., mode='same').
+  """
+  data = np.moveaxis(np.asarray(data, dtype=float), axis, 0)
+  L = data.shape[0]
+
+  # Remove the mean first (and add it back for the samples in each window),
+  # so the cumulative sum doesn't grow and lose precision.
+  μ = np.mean(data, axis=0)
+
+  # Cumulative sum with a leading zero, so any window sum is a difference.
+  csum = np.zeros((L + 1,) + data.shape[1:])
+  np.cumsum(data - μ, axis=0, out=csum[1:])
+
+  # Window ends (exclusive) and starts, clipped to the data.
+  stop = np.arange(L) + (nd - 1)//2 + 1
+  end = np.minimum(stop, L)
+  start = np.maximum(stop - nd, 0)
+
+  count = (end - start).reshape((L,) + (1,) * (data.ndim - 1))
+  filt = (csum[end] - csum[start] + count * μ) / nd
+  return np.moveaxis(filt, 0, axis)
+
+def _smooth_convolve(data, nd, axis):
+  """
+  Original column-by-column smoothing with np.convolve.
+  """
+  if data.ndim > 1:
+      filt = np.zeros(data.shape)
+      for i in range(data.shape[::-1][axis]):
+          if axis == 0:
+              filt[:, i] = np.convolve(
+                  data[:, i], np.ones((nd,))/nd, mode='same')
+          elif axis == 1:
+              filt[i, :] = np.convolve(
+                  data[i, :], np.ones((nd,))/nd, mode='same')
+  else:
+      filt = np.convolve(data, np.ones((nd,))/nd, mode='same')
+  return filt
\ No newline at end of file
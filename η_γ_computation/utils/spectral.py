@@ -72,4 +72,55 @@ def admittance(Gxy, Gxx):
   if np.any(Gxy) and np.any(Gxx):
       return np.abs(Gxy)/Gxx
   else:
-      return None
\ No newline at end of file
+      return None
+
+def cross_spectral_matrix(fts, good=None):
+  """
+  Calculates the matrix of auto- and cross-spectral densities between any
+  number of components, averaged over windows, in a single pass
+
+  Parameters
+  ---------
+  fts : :class:`~numpy.ndarray`
+      Windowed Fourier transforms of C components, of shape (C, W, F) for W
+      windows and F frequencies
+  good : :class:`~numpy.ndarray`, optional
+      Boolean array of shape (W,) flagging the windows to average over. All
+      windows are used if not provided
+  Returns
+  -------
+  G : :class:`~numpy.ndarray`
+      Hermitian matrix of shape (F, C, C), where G[:, i, j] is the spectral
+      density of components `i` and `j`, i.e. the mean of ft_i * conj(ft_j)
+  """
+  if good is not None:
+      fts = fts[:, good]
+  return np.einsum('iwf,jwf->fij', fts, np.conj(fts)) / fts.shape[1]
+
+def cross_spectral_densities(fts, channels, good=None):
+  """
+  Calculates auto- and cross-spectral densities between all pairs of
+  components, labelled by channel
+
+  Parameters
+  ---------
+  fts : :class:`~numpy.ndarray`
+      Windowed Fourier transforms of C components, of shape (C, W, F)
+  channels : list
+      C channel labels, e.g. ['1', '2', 'Z', 'P']
+  good : :class:`~numpy.ndarray`, optional
+      Boolean array of shape (W,) flagging the windows to average over
+  Returns
+  -------
+  : dict
+      Spectral densities keyed by 'c' + channels[i] + channels[j] for i <= j,
+      e.g. 'c11' and 'c1P'. Auto-spectral densities are real
+  """
+  G = cross_spectral_matrix(fts, good)
+  densities = {}
+  for i, a in enumerate(channels):
+      densities['c' + a + a] = np.abs(G[:, i, i])
+  for i, a in enumerate(channels):
+      for j in range(i + 1, len(channels)):
+          densities['c' + a + channels[j]] = G[:, i, j]
+  return densities
\ No newline at end of file
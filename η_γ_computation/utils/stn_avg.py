@@ -0,0 +1,86 @@
+'''
+FUNCTION SET stn_avg.py
+
+A set of functions to compute single-station average η and γ signals and their
+statistics incrementally, i.e. folding in new days of data as they come in,
+rather than recomputing everything from every day each time.
+
+Days are selected (average γ over the compliance band > 0.95) one at a time, so
+selection doesn't depend on other days. The state of a station keeps running
+sums of the selected daily ηs and γs, which give exact means, and a quantile
+sketch of each (see sketch.py), which gives the 2.5 and 97.5% levels in bounded
+memory, along with a bound on their rank error. The state is a dictionary, which
+is simply pickled between runs.
+
+Stephen Mosher, Mar. 2022
+'''
+
+#################################### IMPORTS ###################################
+
+# The usual.
+import numpy as np
+
+# Helper functions.
+from utils import signal, sketch
+
+################################## FUNCTIONS ###################################
+
+def new_state(freqs, depth, stn, low_idx, high_idx, k=256):
+  '''
+  Create the empty state of a station, for η computed at freqs and selected by
+  γ between the frequency indices low_idx and high_idx.
+  '''
+  F = len(freqs)
+  return {'stn': stn,
+          'freqs': freqs,
+          'depth': depth,
+          'band_idx': (low_idx, high_idx),
+          'tks': [],
+          'N': 0,
+          'n': 0,
+          'sum_η': np.zeros(F),
+          'sum_γ': np.zeros(F),
+          'sketch_η': sketch.create(F, k),
+          'sketch_γ': sketch.create(F, k)}
+
+def update(state, tks, daily_ηs, daily_γs):
+  '''
+  Fold (days x freqs) arrays of new daily ηs and γs, with time-keys tks, into
+  the state of a station, in place. Returns the state.
+  '''
+
+  # Keep track of all days seen, selected or not.
+  state['tks'] = state['tks'] + [str(tk) for tk in tks]
+  state['N'] += len(tks)
+
+  # Selective filtering, as for the full computation.
+  low_idx, high_idx = state['band_idx']
+  keep = np.mean(daily_γs[:,low_idx:high_idx], axis=1) > 0.95
+  daily_ηs = np.asarray(daily_ηs[keep])
+  daily_γs = np.asarray(daily_γs[keep])
+
+  # Running sums and quantile sketches.
+  state['n'] += len(daily_ηs)
+  state['sum_η'] += np.sum(daily_ηs, axis=0)
+  state['sum_γ'] += np.sum(daily_γs, axis=0)
+  sketch.update(state['sketch_η'], daily_ηs)
+  sketch.update(state['sketch_γ'], daily_γs)
+
+  return state
+
+def signals(state):
+  '''
+  Average η and γ of a station, and their 2.5 and 97.5% limits scaled by the
+  averages (as returned by signal.statistics()). Also returns the bound on the
+  rank error of the limits.
+  '''
+  μ_η = state['sum_η'] / state['n']
+  μ_γ = state['sum_γ'] / state['n']
+
+  lower_η, upper_η = sketch.quantile(state['sketch_η'], [0.025, 0.975])
+  lower_γ, upper_γ = sketch.quantile(state['sketch_γ'], [0.025, 0.975])
+  σ_η = signal.limits(lower_η, upper_η, μ_η)
+  σ_γ = signal.limits(lower_γ, upper_γ, μ_γ)
+
+  error = max(sketch.error(state['sketch_η']), sketch.error(state['sketch_γ']))
+  return μ_η, μ_γ, σ_η, σ_γ, error
\ No newline at end of file